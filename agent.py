@@ -1,11 +1,13 @@
 import time
+import asyncio
 import threading
-from langchain_openai import AzureChatOpenAI
-from langchain.agents import create_tool_calling_agent, AgentExecutor
-from langchain_core.prompts import ChatPromptTemplate
-from langchain.memory import ConversationBufferWindowMemory
-from constants import AZURE_ENDPOINT, AZURE_API_KEY, AZURE_DEPLOYMENT, AZURE_API_VERSION
+from dataclasses import dataclass
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from constants import AZURE_ENDPOINT, AZURE_API_KEY, AZURE_DEPLOYMENT, AZURE_API_VERSION, AGENT_SESSION_LIMIT, AGENT_SESSION_TTL
 from agent_manager.handlers import StreamingCallbackHandler
+from utils import setup_logging
 from agent_manager.tools import (
     check_stock, 
     end_call, 
@@ -15,79 +17,276 @@ from agent_manager.tools import (
     get_coffee_recommendations
 )
 
-# Session storage for persistent agent instances with memory
-AGENT_SESSIONS = {}
+logger = setup_logging()
 
-def create_agent(system_prompt, memory=None):
+@dataclass(slots=True)
+class StreamChunk:
+    """A chunk of streamed agent output with call-control metadata."""
+    chunk: str
+    is_final: bool = False
+    should_end_call: bool = False
+    should_handoff: bool = False
+    is_interstitial: bool = False
+
+# Session storage for persistent agent instances with memory (LRU ordered)
+AGENT_SESSIONS = OrderedDict()
+_AGENT_SESSIONS_LOCK = threading.Lock()
+
+# Cleared memories from ended sessions, reused for new sessions
+_MEMORY_POOL = []
+
+# Maximum number of pending tokens coalesced into one yielded chunk
+TOKEN_BATCH_SIZE = 8
+
+# Tools available to every agent instance
+_TOOLS = (check_stock, end_call, get_coffeemart_info, get_delivery_status, get_coffee_recommendations, escalate_to_human_agent)
+
+@lru_cache(maxsize=1)
+def _get_llm():
     """
-    Create the LangChain agent with tools and optional memory.
+    Build the shared Azure OpenAI chat client on first use.
     
-    Sets up Azure OpenAI LLM, available tools, and chat prompt template.
-    Supports both stateless and stateful (with memory) configurations.
+    A single client is reused by every session, backed by an explicit
+    httpx connection pool sized for concurrent calls so TLS connections
+    are kept alive and shared rather than rebuilt per call.
     
-    Args:
-        system_prompt (str): System instructions for the agent
-        memory (ConversationBufferWindowMemory, optional): Chat history memory
-        
     Returns:
-        AgentExecutor: Configured LangChain agent executor
+        AzureChatOpenAI: Streaming-enabled chat model client
     """
+    # Imported lazily: the OpenAI client stack dominates cold-start time
+    import httpx
+    from langchain_openai import AzureChatOpenAI
+    
     clean_endpoint = AZURE_ENDPOINT.replace("/openai/v1/", "").rstrip("/")
-    llm = AzureChatOpenAI(
+    http_async_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=50)
+    )
+    return AzureChatOpenAI(
         azure_endpoint=clean_endpoint,
         api_key=AZURE_API_KEY,
         azure_deployment=AZURE_DEPLOYMENT,
         api_version=AZURE_API_VERSION,
+        http_async_client=http_async_client,
         streaming=True
     )
+
+@lru_cache(maxsize=None)
+def _get_prompt(system_prompt, with_memory):
+    """
+    Build and cache the chat prompt template for a system prompt.
     
-    tools = [check_stock, end_call, get_coffeemart_info, get_delivery_status, get_coffee_recommendations, escalate_to_human_agent]
+    Args:
+        system_prompt (str): System instructions for the agent
+        with_memory (bool): Whether to include the chat history placeholder
+        
+    Returns:
+        ChatPromptTemplate: Prompt template for the tool-calling agent
+    """
+    from langchain_core.prompts import ChatPromptTemplate
     
     # Configure prompt template based on memory usage
-    if memory:
-        prompt = ChatPromptTemplate.from_messages([
+    if with_memory:
+        return ChatPromptTemplate.from_messages([
             ("system", system_prompt),
             ("placeholder", "{chat_history}"),
             ("human", "{input}"),
             ("placeholder", "{agent_scratchpad}")
         ])
-    else:
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", system_prompt),
-            ("human", "{input}"),
-            ("placeholder", "{agent_scratchpad}")
-        ])
+    return ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        ("human", "{input}"),
+        ("placeholder", "{agent_scratchpad}")
+    ])
+
+@lru_cache(maxsize=None)
+def _get_tool_calling_agent(system_prompt, with_memory):
+    """
+    Build and cache the tool-calling agent runnable for a system prompt.
     
-    agent = create_tool_calling_agent(llm, tools, prompt)
+    The runnable holds no conversation state (memory lives on the
+    AgentExecutor), so one instance is shared by every session.
+    
+    Args:
+        system_prompt (str): System instructions for the agent
+        with_memory (bool): Whether the prompt includes chat history
+        
+    Returns:
+        Runnable: Tool-calling agent bound to the shared LLM and tools
+    """
+    from langchain.agents import create_tool_calling_agent
+    
+    return create_tool_calling_agent(_get_llm(), _TOOLS, _get_prompt(system_prompt, with_memory))
+
+def warm_up_agents(system_prompts):
+    """
+    Pre-build agent components for known system prompts in parallel.
+    
+    Builds the shared LLM client and prompt templates concurrently on a
+    thread pool, then the agent runnables, so the first call for each
+    prompt does not pay the construction cost.
+    
+    Args:
+        system_prompts (Iterable[str]): System prompt variants to prepare
+    """
+    variants = [(system_prompt, with_memory) for system_prompt in system_prompts for with_memory in (True, False)]
+    try:
+        with ThreadPoolExecutor() as executor:
+            futures = [executor.submit(_get_llm)]
+            futures += [executor.submit(_get_prompt, *variant) for variant in variants]
+            for future in futures:
+                future.result()
+            list(executor.map(lambda variant: _get_tool_calling_agent(*variant), variants))
+        logger.info(f"Warmed up {len(variants)} agent variants")
+    except Exception as e:
+        logger.error(f"Error warming up agents: {e}")
+
+def create_agent(system_prompt, memory=None):
+    """
+    Create the LangChain agent with tools and optional memory.
+    
+    Wraps the cached tool-calling agent (shared Azure OpenAI LLM, tools and
+    prompt template) in a new executor. Supports both stateless and stateful (with memory) configurations.
+    
+    Args:
+        system_prompt (str): System instructions for the agent
+        memory (ConversationBufferWindowMemory, optional): Chat history memory
+        
+    Returns:
+        AgentExecutor: Configured LangChain agent executor
+    """
+    from langchain.agents import AgentExecutor
+    
+    agent = _get_tool_calling_agent(system_prompt, memory is not None)
     return AgentExecutor(
         agent=agent, 
-        tools=tools, 
+        tools=_TOOLS, 
         memory=memory,
         verbose=True, 
         stream_runnable=True
     )
 
-def run_agent(agent_executor, conversation_context, stream_handler, response_container, exception_container):
+def _evict_agent_sessions(now):
+    """
+    Drop idle and least-recently-used sessions beyond the cache limits.
+    
+    Must be called with the session lock held.
+    
+    Args:
+        now (float): Current monotonic time
+    """
+    # Oldest entries come first, so stop at the first session still in use
+    while AGENT_SESSIONS:
+        session_id, session = next(iter(AGENT_SESSIONS.items()))
+        if len(AGENT_SESSIONS) <= AGENT_SESSION_LIMIT and now - session['last_used'] < AGENT_SESSION_TTL:
+            break
+        del AGENT_SESSIONS[session_id]
+        _recycle_memory(session)
+
+def _recycle_memory(session):
+    """
+    Clear a dropped session's memory and return it to the pool.
+    
+    Memory still in use by a running response is left to the garbage
+    collector so no history can leak into another session. Must be called
+    with the session lock held.
+    
+    Args:
+        session (dict): Session entry being dropped
+    """
+    if session.get('active') or len(_MEMORY_POOL) >= AGENT_SESSION_LIMIT:
+        return
+    memory = session['memory']
+    memory.clear()
+    _MEMORY_POOL.append(memory)
+
+def get_agent_session(session_id, system_prompt):
+    """
+    Get or create the session-specific agent with memory.
+    
+    Sessions are kept in LRU order and bounded by AGENT_SESSION_LIMIT;
+    sessions idle for longer than AGENT_SESSION_TTL seconds are purged.
+    
+    Args:
+        session_id (str): Unique session identifier
+        system_prompt (str): System instructions for the agent
+        
+    Returns:
+        dict: Session entry with 'handler', 'agent' and 'memory'
+    """
+    now = time.monotonic()
+    with _AGENT_SESSIONS_LOCK:
+        session = AGENT_SESSIONS.get(session_id)
+        if session is None:
+            if _MEMORY_POOL:
+                memory = _MEMORY_POOL.pop()
+            else:
+                from langchain.memory import ConversationBufferWindowMemory
+                
+                # Create memory for this session (keep last 10 exchanges)
+                memory = ConversationBufferWindowMemory(
+                    k=10,
+                    memory_key="chat_history",
+                    return_messages=True
+                )
+            session = {
+                'handler': StreamingCallbackHandler(),
+                'agent': create_agent(system_prompt, memory),
+                'memory': memory
+            }
+            AGENT_SESSIONS[session_id] = session
+        else:
+            AGENT_SESSIONS.move_to_end(session_id)
+        session['last_used'] = now
+        _evict_agent_sessions(now)
+    return session
+
+def release_agent_session(session_id):
     """
-    Run the agent executor in a separate thread.
+    Remove a session's agent once its call has ended.
+    
+    Args:
+        session_id (str): Unique session identifier
+    """
+    with _AGENT_SESSIONS_LOCK:
+        session = AGENT_SESSIONS.pop(session_id, None)
+        if session is not None:
+            _recycle_memory(session)
+
+async def run_agent(agent_executor, conversation_context, stream_handler):
+    """
+    Run the agent executor and feed its stream events to the handler.
+    
+    Consumes LangChain's native ``astream_events`` so the agent runs on the
+    event loop; model tokens and tool lifecycle events are routed to the
+    streaming handler, which queues them for the response generator.
+    On this async path AgentExecutor dispatches every tool call emitted in
+    a single model turn concurrently (asyncio.gather), so independent
+    lookups overlap instead of running back to back.
     
     Args:
         agent_executor (AgentExecutor): The LangChain agent to execute
         conversation_context (str): User input to process
-        stream_handler (StreamingCallbackHandler): Callback handler for streaming
-        response_container (dict): Container to store successful response
-        exception_container (dict): Container to store any exceptions
+        stream_handler (StreamingCallbackHandler): Handler receiving stream events
     """
     try:
-        response = agent_executor.invoke(
-            {"input": conversation_context},
-            {"callbacks": [stream_handler]}
-        )
-        response_container['result'] = response
-    except Exception as e:
-        exception_container['error'] = e
+        async for event in agent_executor.astream_events({"input": conversation_context}, version="v2"):
+            kind = event["event"]
+            if kind == "on_chat_model_stream":
+                token = event["data"]["chunk"].content
+                if token:
+                    stream_handler.on_llm_new_token(token)
+            elif kind == "on_chat_model_start":
+                stream_handler.on_llm_start(event, None)
+            elif kind == "on_chat_model_end":
+                stream_handler.on_llm_end(event["data"].get("output"))
+            elif kind == "on_tool_start":
+                stream_handler.on_tool_start({"name": event["name"]}, event["data"].get("input"))
+            elif kind == "on_tool_end":
+                stream_handler.on_tool_end(event["data"].get("output"))
+    finally:
+        stream_handler.finish()
 
-async def generate_agent_response_stream(session_id, user_message, system_prompt, conversation_histories):
+async def generate_agent_response_stream(session_id, user_message, system_prompt, history, assistant_indices):
     """
     Generate a streaming response using LangChain agent with tools.
     
@@ -98,139 +297,125 @@ async def generate_agent_response_stream(session_id, user_message, system_prompt
         session_id (str): Unique session identifier
         user_message (str): User input to process
         system_prompt (str): System instructions for the agent
-        conversation_histories (dict): Session conversation histories
+        history (list): Session conversation history
+        assistant_indices (deque): Positions of assistant responses in history
         
     Yields:
-        dict: Streaming response chunks with metadata
+        StreamChunk: Streaming response chunks with metadata
     """
-    # Initialize conversation history if it doesn't exist
-    if session_id not in conversation_histories:
-        conversation_histories[session_id] = []
-    
     # Add user message to history
-    conversation_histories[session_id].append({"role": "user", "content": user_message})
+    history.append({"role": "user", "content": user_message})
+    
+    session = None
+    agent_task = None
     
     try:
         # Get or create session-specific agent with memory
-        if session_id not in AGENT_SESSIONS:
-            # Create memory for this session (keep last 10 exchanges)
-            memory = ConversationBufferWindowMemory(
-                k=10,
-                memory_key="chat_history",
-                return_messages=True
-            )
-            AGENT_SESSIONS[session_id] = {
-                'handler': StreamingCallbackHandler(),
-                'agent': create_agent(system_prompt, memory),
-                'memory': memory
-            }
+        session = get_agent_session(session_id, system_prompt)
+        session['active'] = True
+        stream_handler = session['handler']
+        agent_executor = session['agent']
         
-        stream_handler = AGENT_SESSIONS[session_id]['handler']
-        agent_executor = AGENT_SESSIONS[session_id]['agent']
-        
-        # Reset handler state for new request (preserve phrase_index for round-robin)
-        stream_handler.buffer = ""
-        stream_handler.tokens = []
-        stream_handler.tool_executing = False
-        stream_handler.call_end_detected = False
-        stream_handler.handoff_detected = False
-        stream_handler.interstitial_sent = False
-        stream_handler.interstitial_ready = False
-        stream_handler.sent_interstitials = []
-        # Cancel any existing timer to prevent multiple interstitials
-        if hasattr(stream_handler, 'interstitial_timer') and stream_handler.interstitial_timer.is_alive():
-            stream_handler.interstitial_timer.cancel()
+        # Reset handler state for new request (preserve phrase rotation for round-robin)
+        stream_handler.reset()
         
         # With memory, we just pass the current user message
         # The agent's memory will handle conversation history automatically
         conversation_context = user_message
         
-        # Start agent execution in background
-        response_container = {}
-        exception_container = {}
+        # Tokens and interstitials are queued on the handler's event deque
+        stream_handler.attach(asyncio.get_running_loop())
+        events = stream_handler.events
         
-        # Execute agent in background thread
-        thread = threading.Thread(target=run_agent, args=(agent_executor, conversation_context, stream_handler, response_container, exception_container))
-        thread.start()
+        # Execute agent as a background task on this event loop
+        agent_task = asyncio.create_task(run_agent(agent_executor, conversation_context, stream_handler))
         
         # Stream tokens as they arrive with interstitial support
-        last_token_count = 0
         interstitial_sent_this_response = False
+        done = False
+        batch = []
         
-        while thread.is_alive() or last_token_count < len(stream_handler.tokens):
-            current_token_count = len(stream_handler.tokens)
-            
-            # Check if we need to send an interstitial phrase (only once per response)
-            if stream_handler.should_send_interstitial() and not interstitial_sent_this_response:
-                interstitial = stream_handler.get_next_interstitial()
-                stream_handler.interstitial_sent = True
-                stream_handler.interstitial_ready = False  # Reset flag
-                interstitial_sent_this_response = True  # Mark as sent for this response
-                stream_handler.sent_interstitials.append(interstitial)  # Track for conversation history
-                print(f"[STREAMING] Sending interstitial: {interstitial}")
-                yield {
-                    "chunk": interstitial,
-                    "is_final": True,
-                    "should_end_call": False,
-                    "should_handoff": False,
-                    "is_interstitial": True
-                }
+        while not done:
+            # Clear before draining so events appended meanwhile re-arm the wakeup
+            await stream_handler.events_ready.wait()
+            stream_handler.events_ready.clear()
             
-            # Yield new tokens
-            for i in range(last_token_count, current_token_count):
-                token = stream_handler.tokens[i]
-                yield {
-                    "chunk": token,
-                    "is_final": False,
-                    "should_end_call": stream_handler.call_end_detected,
-                    "should_handoff": stream_handler.handoff_detected,
-                    "is_interstitial": False
-                }
-            
-            last_token_count = current_token_count
-            
-            time.sleep(0.001)
-        
-        # Wait for thread to complete
-        thread.join()
+            while events:
+                kind, value = events.popleft()
+                
+                if kind == "done":
+                    done = True
+                    break
+                
+                # Check if we need to send an interstitial phrase (only once per response)
+                if kind == "interstitial":
+                    if stream_handler.should_send_interstitial() and not interstitial_sent_this_response:
+                        interstitial = stream_handler.get_next_interstitial()
+                        stream_handler.interstitial_sent = True
+                        stream_handler.interstitial_ready = False  # Reset flag
+                        interstitial_sent_this_response = True  # Mark as sent for this response
+                        # Track for conversation history, already shaped as a history entry
+                        stream_handler.sent_interstitials.append({"role": "assistant", "content": interstitial, "type": "interstitial"})
+                        logger.debug("[STREAMING] Sending interstitial: %s", interstitial)
+                        yield StreamChunk(interstitial, is_final=True, is_interstitial=True)
+                    continue
+                
+                # Coalesce consecutive pending tokens into a single chunk
+                batch.append(value)
+                if len(batch) < TOKEN_BATCH_SIZE and events and events[0][0] == "token":
+                    continue
+                
+                # Yield batched tokens
+                chunk = "".join(batch)
+                batch.clear()
+                yield StreamChunk(
+                    chunk,
+                    should_end_call=stream_handler.call_end_detected,
+                    should_handoff=stream_handler.handoff_detected
+                )
         
-        # Check for exceptions
-        if 'error' in exception_container:
-            raise exception_container['error']
+        # Wait for the agent run to complete (re-raises any agent error)
+        await agent_task
         
         # Final token to indicate completion
         full_response = "".join(stream_handler.tokens)
         
-        # Process response and update conversation history
-        if stream_handler.call_end_detected and "CALL_END:" in full_response:
-            clean_response = full_response.split("CALL_END:", 1)[1].strip()
-            conversation_histories[session_id].append({"role": "assistant", "content": clean_response})
-        elif stream_handler.handoff_detected and "HANDOFF_HUMAN:" in full_response:
-            clean_response = full_response.split("HANDOFF_HUMAN:", 1)[1].strip()
-            conversation_histories[session_id].append({"role": "assistant", "content": clean_response})
-        else:
-            conversation_histories[session_id].append({"role": "assistant", "content": full_response})
+        # Process response and update conversation history (marker offsets were recorded while streaming)
+        clean_response = None
+        if stream_handler.call_end_detected:
+            clean_response = stream_handler.strip_marker(full_response, "CALL_END:")
+        if clean_response is None and stream_handler.handoff_detected:
+            clean_response = stream_handler.strip_marker(full_response, "HANDOFF_HUMAN:")
+        if clean_response is None:
+            clean_response = full_response
+        # Lowercased text and words are kept for barge-in redaction
+        clean_lower = clean_response.lower()
+        history.append({
+            "role": "assistant",
+            "content": clean_response,
+            "content_lower": clean_lower,
+            "words_lower": clean_lower.split()
+        })
+        assistant_indices.append(len(history) - 1)
         
         # Add any interstitials that were sent to conversation history
-        if hasattr(stream_handler, 'sent_interstitials'):
-            for interstitial in stream_handler.sent_interstitials:
-                conversation_histories[session_id].append({"role": "assistant", "content": interstitial, "type": "interstitial"})
+        history.extend(stream_handler.sent_interstitials)
         
         # Final yield
-        yield {
-            "chunk": "",
-            "is_final": True,
-            "should_end_call": stream_handler.call_end_detected,
-            "should_handoff": stream_handler.handoff_detected,
-            "is_interstitial": False
-        }
+        yield StreamChunk(
+            "",
+            is_final=True,
+            should_end_call=stream_handler.call_end_detected,
+            should_handoff=stream_handler.handoff_detected
+        )
         
     except Exception as e:
-        print(f"Error in streaming agent response: {e}")
-        yield {
-            "chunk": "I'm sorry, I'm having trouble processing your request right now.",
-            "is_final": True,
-            "should_end_call": False,
-            "should_handoff": False,
-            "is_interstitial": False
-        }
+        logger.error(f"Error in streaming agent response: {e}")
+        yield StreamChunk("I'm sorry, I'm having trouble processing your request right now.", is_final=True)
+    
+    finally:
+        # Stop an abandoned agent run so it cannot write to recycled memory
+        if agent_task is not None and not agent_task.done():
+            agent_task.cancel()
+        if session is not None:
+            session['active'] = False
@@ -1,41 +1,122 @@
 """Agent callback handlers for streaming and call management."""
 import time
-import threading
+import asyncio
+import logging
+import itertools
+from collections import deque
 from langchain.callbacks.base import BaseCallbackHandler
+from utils import setup_logging
+
+logger = setup_logging()
+
+# Call-control markers emitted by the end_call and escalation tools
+STREAM_MARKERS = ("CALL_END:", "HANDOFF_HUMAN:")
+_MARKER_TAIL = max(len(marker) for marker in STREAM_MARKERS) - 1
 
 class StreamingCallbackHandler(BaseCallbackHandler):
     """Handles LLM streaming with interstitial phrases during tool execution.
     
     Manages token streaming, tool execution timing, and automatic interstitial
     phrase injection to provide natural conversation flow during processing delays.
+    Callback methods are driven from the agent's ``astream_events`` stream.
     """
     
+    # BaseCallbackHandler is not slotted, so instances keep a __dict__; the
+    # slots still give faster access to the fields touched per token.
+    __slots__ = (
+        "tokens", "token_count", "text_length", "text_tail", "marker_positions",
+        "tool_executing", "tool_start_time", "llm_start_time",
+        "call_end_detected", "handoff_detected", "current_tool", "active_tools",
+        "interstitial_phrases", "no_interstitial_tools", "phrase_cycle",
+        "interstitial_sent", "interstitial_ready", "sent_interstitials",
+        "interstitial_timer", "loop", "events", "events_ready"
+    )
+    
     def __init__(self):
         """Initialize the streaming handler with interstitial configuration."""
-        self.buffer = ""
         self.tokens = []
+        self.token_count = 0  # Tokens streamed so far
+        self.text_length = 0  # Characters streamed so far
+        self.text_tail = ""  # Trailing characters kept to spot markers split across tokens
+        self.marker_positions = {}  # First offset of each call-control marker in the response
         self.tool_executing = False
         self.tool_start_time = None
+        self.llm_start_time = None
         self.call_end_detected = False
         self.handoff_detected = False
         self.current_tool = None  # Track current executing tool
-        self.interstitial_phrases = [
+        self.active_tools = 0  # Tool calls in flight (the executor may run several concurrently)
+        self.interstitial_phrases = (
             "Let me check that for you...",
             "One moment please...",
             "I'm looking into that...",
             "Just a second...",
             "Let me find that information...",
             "Give me just a moment..."
-        ]
+        )
         # Tools that should NOT trigger interstitials (call ending scenarios)
         self.no_interstitial_tools = [
             "end_call",
             "escalate_to_human_agent"
         ]
-        self.phrase_index = 0
+        self.phrase_cycle = itertools.cycle(self.interstitial_phrases)  # Round-robin phrase rotation
+        self.interstitial_sent = False
+        self.interstitial_ready = False
+        self.sent_interstitials = []  # Sent interstitials as conversation history entries
+        self.interstitial_timer = None  # Pending asyncio TimerHandle for the tool interstitial
+        self.loop = None  # Event loop running the response consumer
+        self.events = deque()  # Pending (kind, value) stream events for the consumer
+        self.events_ready = None  # Set whenever events are pending
+        
+    def reset(self):
+        """Reset per-response state in place, keeping the phrase rotation."""
+        self.cancel_interstitial_timer()
+        self.tokens.clear()
+        self.token_count = 0
+        self.text_length = 0
+        self.text_tail = ""
+        self.marker_positions.clear()
+        self.tool_executing = False
+        self.tool_start_time = None
+        self.active_tools = 0
+        self.current_tool = None
+        self.call_end_detected = False
+        self.handoff_detected = False
         self.interstitial_sent = False
         self.interstitial_ready = False
-        self.sent_interstitials = []  # Track sent interstitials for conversation history
+        self.sent_interstitials.clear()
+    
+    def attach(self, loop):
+        """Attach the consumer event loop and reset pending events for the next response.
+        
+        Args:
+            loop (asyncio.AbstractEventLoop): Loop running the response generator
+        """
+        self.loop = loop
+        self.events.clear()
+        self.events_ready = asyncio.Event()
+    
+    def _emit(self, kind, value=None):
+        """Append a stream event and wake the consumer.
+        
+        Args:
+            kind (str): Event kind ("token", "interstitial" or "done")
+            value: Event payload
+        """
+        self.events.append((kind, value))
+        self.events_ready.set()
+    
+    def cancel_interstitial_timer(self):
+        """Cancel the pending interstitial timer, if any."""
+        if self.interstitial_timer is not None:
+            self.interstitial_timer.cancel()
+            self.interstitial_timer = None
+            logger.debug("[STREAMING] Cancelled interstitial timer")
+    
+    def finish(self):
+        """Signal the consumer that the agent run has completed."""
+        self.cancel_interstitial_timer()
+        self._emit("done")
         
     def on_llm_new_token(self, token: str, **kwargs):
         """Handle new tokens from LLM streaming.
@@ -43,19 +124,53 @@ class StreamingCallbackHandler(BaseCallbackHandler):
         Args:
             token (str): New token from LLM
         """
-        self.buffer += token
         self.tokens.append(token)
-        print(f"[STREAMING] Token received: '{token}' (total tokens: {len(self.tokens)}) - timestamp: {time.time()}")
+        self.token_count += 1
+        self._emit("token", token)
+        self._track_markers(token)
         
         # Cancel interstitial timer when LLM tokens start arriving
-        if hasattr(self, 'interstitial_timer') and self.interstitial_timer.is_alive():
-            self.interstitial_timer.cancel()
-            print(f"[STREAMING] Cancelled interstitial timer - LLM tokens arriving")
+        self.cancel_interstitial_timer()
         
         # Reset interstitial state when actual content begins
         if self.interstitial_sent and token.strip():
             self.interstitial_sent = False
         
+    def _track_markers(self, token):
+        """Record where call-control markers first appear in the response.
+        
+        Only a short rolling tail is scanned, so the final response never
+        has to be searched again.
+        
+        Args:
+            token (str): New token from LLM
+        """
+        window = self.text_tail + token
+        if len(self.marker_positions) < len(STREAM_MARKERS):
+            window_start = self.text_length - len(self.text_tail)
+            for marker in STREAM_MARKERS:
+                if marker not in self.marker_positions:
+                    index = window.find(marker)
+                    if index != -1:
+                        self.marker_positions[marker] = window_start + index
+        self.text_length += len(token)
+        self.text_tail = window[-_MARKER_TAIL:]
+    
+    def strip_marker(self, full_response, marker):
+        """Return the response text after a marker seen during streaming.
+        
+        Args:
+            full_response (str): Complete response text
+            marker (str): Call-control marker to strip
+            
+        Returns:
+            str: Text after the marker, or None if the marker was not streamed
+        """
+        position = self.marker_positions.get(marker)
+        if position is None:
+            return None
+        return full_response[position + len(marker):].strip()
+    
     def on_llm_start(self, serialized, prompts, **kwargs):
         """Handle LLM processing start.
         
@@ -66,7 +181,7 @@ class StreamingCallbackHandler(BaseCallbackHandler):
         self.llm_start_time = time.time()
         self.interstitial_sent = False
         self.interstitial_ready = False
-        print(f"[STREAMING] LLM started - interstitials will be handled by tool calls")
+        logger.debug("[STREAMING] LLM started - interstitials will be handled by tool calls")
     
     def on_tool_start(self, serialized, input_str, **kwargs):
         """Handle tool execution start and manage interstitial timing.
@@ -76,24 +191,25 @@ class StreamingCallbackHandler(BaseCallbackHandler):
             input_str: Tool input parameters
         """
         tool_name = serialized.get("name", "unknown")
+        self.active_tools += 1
         self.tool_executing = True
-        self.tool_start_time = time.time()
+        if self.tool_start_time is None:
+            self.tool_start_time = time.time()
         self.current_tool = tool_name
         
         if tool_name == "end_call":
             self.call_end_detected = True
-            print(f"[STREAMING] end_call tool invoked - call will end")
+            logger.debug("[STREAMING] end_call tool invoked - call will end")
         elif tool_name == "escalate_to_human_agent":
             self.handoff_detected = True
-            print(f"[STREAMING] escalate_to_human_agent tool invoked - handoff will occur")
+            logger.debug("[STREAMING] escalate_to_human_agent tool invoked - handoff will occur")
         else:
-            print(f"[STREAMING] Tool {tool_name} started")
+            logger.debug("[STREAMING] Tool %s started", tool_name)
             # Start 0.4s timer for interstitial (except call-ending tools)
             if tool_name not in self.no_interstitial_tools:
-                if not hasattr(self, 'interstitial_timer') or not self.interstitial_timer.is_alive():
-                    self.interstitial_timer = threading.Timer(0.4, self._trigger_interstitial)
-                    self.interstitial_timer.start()
-                    print(f"[STREAMING] Timer started for tool interstitial")
+                if self.interstitial_timer is None:
+                    self.interstitial_timer = self.loop.call_later(0.4, self._trigger_interstitial)
+                    logger.debug("[STREAMING] Timer started for tool interstitial")
         
     def on_llm_end(self, response, **kwargs):
         """Handle LLM processing completion.
@@ -102,9 +218,8 @@ class StreamingCallbackHandler(BaseCallbackHandler):
             response: LLM response data
         """
         # Cancel pending interstitial timer on LLM completion
-        if hasattr(self, 'interstitial_timer') and self.interstitial_timer.is_alive():
-            self.interstitial_timer.cancel()
-        print(f"[STREAMING] LLM completed")
+        self.cancel_interstitial_timer()
+        logger.debug("[STREAMING] LLM completed")
     
     def on_tool_end(self, output, **kwargs):
         """Handle tool execution completion.
@@ -112,25 +227,30 @@ class StreamingCallbackHandler(BaseCallbackHandler):
         Args:
             output: Tool execution output
         """
-        self.tool_executing = False
-        self.tool_start_time = None
-        self.current_tool = None
+        # Only clear tool state once every concurrent tool call has finished
+        self.active_tools = max(0, self.active_tools - 1)
+        if not self.active_tools:
+            self.tool_executing = False
+            self.tool_start_time = None
+            self.current_tool = None
         
         if self.call_end_detected:
-            print(f"[STREAMING] end_call tool completed with output: {output}")
+            logger.debug("[STREAMING] end_call tool completed with output: %s", output)
         elif self.handoff_detected:
-            print(f"[STREAMING] escalate_to_human_agent tool completed with output: {output}")
+            logger.debug("[STREAMING] escalate_to_human_agent tool completed with output: %s", output)
     
     def _trigger_interstitial(self):
         """Timer callback to trigger interstitial phrase after delay."""
+        self.interstitial_timer = None
         if not self.interstitial_sent and not self.interstitial_ready:
             # Skip interstitials when call is ending or transferring
             if self.call_end_detected or self.handoff_detected:
-                print(f"[STREAMING] Timer triggered but skipping - call ending scenario detected")
+                logger.debug("[STREAMING] Timer triggered but skipping - call ending scenario detected")
                 return
             
             self.interstitial_ready = True
-            print(f"[STREAMING] Timer triggered - interstitial ready")
+            self._emit("interstitial")
+            logger.debug("[STREAMING] Timer triggered - interstitial ready")
         
     def get_next_interstitial(self):
         """Get next interstitial phrase using round-robin selection.
@@ -138,9 +258,7 @@ class StreamingCallbackHandler(BaseCallbackHandler):
         Returns:
             str: Next interstitial phrase from the rotation
         """
-        phrase = self.interstitial_phrases[self.phrase_index]
-        self.phrase_index = (self.phrase_index + 1) % len(self.interstitial_phrases)
-        return phrase
+        return next(self.phrase_cycle)
         
     def should_send_interstitial(self):
         """Check if an interstitial phrase should be sent.
@@ -154,7 +272,7 @@ class StreamingCallbackHandler(BaseCallbackHandler):
                       not self.call_end_detected and 
                       not self.handoff_detected)
         
-        if self.interstitial_ready:
-            print(f"[STREAMING] Interstitial check: ready={self.interstitial_ready}, sent={self.interstitial_sent}, tokens={len(self.tokens)}, result={should_send}")
+        if self.interstitial_ready and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[STREAMING] Interstitial check: ready=%s, sent=%s, tokens=%s, result=%s", self.interstitial_ready, self.interstitial_sent, self.token_count, should_send)
         
         return should_send
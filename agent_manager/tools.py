@@ -1,9 +1,109 @@
 """Agent tools for CoffeeMarket voice assistant operations."""
+import heapq
+import re
+import string
+from collections import ChainMap
+from functools import lru_cache
 from langchain_core.tools import tool
 from loaders import COFFEE_DB, KNOWLEDGE_BASE, DELIVERY_STATUS_DB, INVENTORY_DB
 
+# Inventory search index built once at import: (lowercased name, category, product info)
+# in search order, coffee beans before equipment
+_STOCK_INDEX = tuple(
+    (product_info['name'].lower(), category, product_info)
+    for category in ('coffee_beans', 'equipment')
+    for product_info in INVENTORY_DB.get(category, {}).values()
+)
+# Exact-name lookup; built from the reversed index so the first match in search order wins
+_STOCK_EXACT = {
+    name_lower: (category, product_info)
+    for name_lower, category, product_info in reversed(_STOCK_INDEX)
+}
+
+def _build_name_trie(index):
+    """Build a prefix trie over product-name words.
+    
+    Every node records the index positions of products having a name word
+    that starts with the prefix spelled by the path to that node.
+    
+    Args:
+        index: Inventory search index of (name_lower, category, product_info)
+    
+    Returns:
+        Root trie node as {"ids": set, "children": dict}
+    """
+    root = {"ids": set(), "children": {}}
+    for position, (name_lower, _, _) in enumerate(index):
+        for word in name_lower.split():
+            node = root
+            for char in word:
+                node = node["children"].setdefault(char, {"ids": set(), "children": {}})
+                node["ids"].add(position)
+    return root
+
+_NAME_TRIE = _build_name_trie(_STOCK_INDEX)
+
+def _products_with_word_prefix(word):
+    """Return index positions of products with a name word starting with word."""
+    node = _NAME_TRIE
+    for char in word:
+        node = node["children"].get(char)
+        if node is None:
+            return ()
+    return node["ids"]
+
+# Stock message templates, filled from the product's inventory record
+_OUT_OF_STOCK_RESTOCK_TEMPLATE = "{name} is currently out of stock. Expected restock date: {expected_restock}. Price: {price}"
+_OUT_OF_STOCK_TEMPLATE = "{name} is currently out of stock. Price: {price}"
+_LOW_STOCK_TEMPLATE = "{name} is running low! Only {stock_level} {unit} remaining. Price: {price}. We recommend ordering soon."
+_IN_STOCK_TEMPLATE = "{name} is in stock! We have {stock_level} {unit} available. Price: {price}"
+_RESTOCK_DEFAULTS = {'expected_restock': 'Unknown'}
+
+@lru_cache(maxsize=512)
+def _check_stock_impl(product_name_lower):
+    """Look up stock for a normalized product name.
+    
+    Results are memoized; call _check_stock_impl.cache_clear() after
+    reloading INVENTORY_DB.
+    
+    Args:
+        product_name_lower: Lowercased, stripped product name
+    
+    Returns:
+        Tuple of (stock message or None, suggested product names)
+    """
+    # Exact product name first, then the first product whose name contains the query
+    match = _STOCK_EXACT.get(product_name_lower)
+    if match is None:
+        for name_lower, category, product_info in _STOCK_INDEX:
+            if product_name_lower in name_lower:
+                match = (category, product_info)
+                break
+    
+    if match is not None:
+        category, product_info = match
+        status = product_info['status']
+        
+        if status == "out_of_stock":
+            # Only coffee beans carry restock dates
+            if category == 'coffee_beans':
+                return _OUT_OF_STOCK_RESTOCK_TEMPLATE.format_map(ChainMap(product_info, _RESTOCK_DEFAULTS)), ()
+            return _OUT_OF_STOCK_TEMPLATE.format_map(product_info), ()
+        elif status == "low_stock":
+            return _LOW_STOCK_TEMPLATE.format_map(product_info), ()
+        else:
+            return _IN_STOCK_TEMPLATE.format_map(product_info), ()
+    
+    # Suggest similar products if no match found, ranked by how many distinct query words they match
+    match_counts = {}
+    for word in set(product_name_lower.split()):
+        for position in _products_with_word_prefix(word):
+            match_counts[position] = match_counts.get(position, 0) + 1
+    ranked = sorted(match_counts, key=lambda position: (-match_counts[position], position))
+    return None, tuple(_STOCK_INDEX[position][2]['name'] for position in ranked[:3])
+
 @tool
-def check_stock(product_name: str) -> str:
+async def check_stock(product_name: str) -> str:
     """Check stock availability for coffee beans and equipment.
     
     Args:
@@ -12,62 +112,19 @@ def check_stock(product_name: str) -> str:
     Returns:
         String with stock information including availability, price, and restock dates if applicable
     """
-    product_name_lower = product_name.lower().strip()
-    
-    # Search through coffee beans
-    coffee_beans = INVENTORY_DB.get('coffee_beans', {})
-    for product_id, product_info in coffee_beans.items():
-        if product_name_lower in product_info['name'].lower():
-            stock_level = product_info['stock_level']
-            status = product_info['status']
-            price = product_info['price']
-            name = product_info['name']
-            unit = product_info['unit']
-            
-            if status == "out_of_stock":
-                expected_restock = product_info.get('expected_restock', 'Unknown')
-                return f"{name} is currently out of stock. Expected restock date: {expected_restock}. Price: {price}"
-            elif status == "low_stock":
-                return f"{name} is running low! Only {stock_level} {unit} remaining. Price: {price}. We recommend ordering soon."
-            else:
-                return f"{name} is in stock! We have {stock_level} {unit} available. Price: {price}"
-    
-    # Search through equipment
-    equipment = INVENTORY_DB.get('equipment', {})
-    for product_id, product_info in equipment.items():
-        if product_name_lower in product_info['name'].lower():
-            stock_level = product_info['stock_level']
-            status = product_info['status']
-            price = product_info['price']
-            name = product_info['name']
-            unit = product_info['unit']
-            
-            if status == "out_of_stock":
-                return f"{name} is currently out of stock. Price: {price}"
-            elif status == "low_stock":
-                return f"{name} is running low! Only {stock_level} {unit} remaining. Price: {price}. We recommend ordering soon."
-            else:
-                return f"{name} is in stock! We have {stock_level} {unit} available. Price: {price}"
-    
-    # Suggest similar products if no exact match found
-    suggestions = []
-    all_products = {}
-    all_products.update(coffee_beans)
-    all_products.update(equipment)
-    
-    for product_id, product_info in all_products.items():
-        if any(word in product_info['name'].lower() for word in product_name_lower.split()):
-            suggestions.append(product_info['name'])
+    stock_message, suggestions = _check_stock_impl(product_name.lower().strip())
+    if stock_message is not None:
+        return stock_message
     
     if suggestions:
-        suggestion_text = ", ".join(suggestions[:3])  # Show up to 3 suggestions
+        suggestion_text = ", ".join(suggestions)  # Show up to 3 suggestions
         return f"I couldn't find '{product_name}' in our inventory. Did you mean: {suggestion_text}? Please try again with the exact product name."
     
     return f"I couldn't find '{product_name}' in our inventory. Please check the product name or ask about our available coffee beans and equipment."
 
 
 @tool
-def end_call(reason: str = "Customer request") -> str:
+async def end_call(reason: str = "Customer request") -> str:
     """End the current call gracefully when customer is satisfied.
     
     ONLY use when customer says goodbye, thanks you, or indicates they're done.
@@ -100,81 +157,157 @@ def end_call(reason: str = "Customer request") -> str:
     return f"CALL_END:{message}"
 
 
-@tool
-def get_coffeemart_info(query: str) -> str:
-    """Look up CoffeeMarket information including policies, hours, brewing guides, and company info.
+# Knowledge base sections and the query keywords that select them
+_KB_SECTION_KEYWORDS = {
+    'company_info': ('hours', 'location', 'address', 'phone', 'contact'),
+    'store_policies': ('return', 'refund', 'policy', 'exchange', 'warranty'),
+    'loyalty_program': ('loyalty', 'rewards', 'points', 'member'),
+    'sustainability': ('sustainability', 'environment', 'eco', 'green', 'organic', 'fair trade'),
+    'brewing_guides': ('brew', 'brewing', 'coffee', 'espresso', 'grind', 'ratio'),
+    'equipment_care': ('clean', 'maintenance', 'care', 'machine', 'grinder'),
+}
+
+def _build_kb_keyword_matcher(section_keywords):
+    """Compile all section keywords into a single-pass matcher.
+    
+    The lookahead pattern reports the longest keyword starting at every
+    position of the query. Each keyword maps to the sections of every
+    keyword it contains, so shorter overlapping keywords (e.g. "grind"
+    inside "grinder") still select their sections.
     
     Args:
-        query: The customer's question or topic they want information about
+        section_keywords: Mapping of section name to keyword tuple
+    
+    Returns:
+        Tuple of (compiled pattern, keyword -> frozenset of sections)
+    """
+    keyword_sections = {}
+    for section, keywords in section_keywords.items():
+        for keyword in keywords:
+            keyword_sections.setdefault(keyword, set()).add(section)
+    expanded = {
+        keyword: frozenset(
+            section
+            for other, other_sections in keyword_sections.items() if other in keyword
+            for section in other_sections
+        )
+        for keyword in keyword_sections
+    }
+    alternatives = "|".join(re.escape(keyword) for keyword in sorted(expanded, key=len, reverse=True))
+    return re.compile(f"(?=({alternatives}))"), expanded
+
+_KB_KEYWORD_PATTERN, _KB_KEYWORD_SECTIONS = _build_kb_keyword_matcher(_KB_SECTION_KEYWORDS)
+
+def _match_kb_sections(query_lower):
+    """Return the knowledge base sections whose keywords occur in the query."""
+    sections = set()
+    for match in _KB_KEYWORD_PATTERN.finditer(query_lower):
+        sections |= _KB_KEYWORD_SECTIONS[match.group(1)]
+    return sections
+
+def _company_info_section(query_lower):
+    """Store hours and locations."""
+    info = []
+    company_info = KNOWLEDGE_BASE.get('company_info', {})
+    if 'store_hours' in company_info:
+        info.append(f"Store Hours: {company_info['store_hours']}")
+    if 'locations' in company_info:
+        locations = company_info['locations']
+        for location in locations:
+            info.append(f"{location['name']}: {location['address']}, Phone: {location['phone']}")
+    return info
+
+def _store_policies_section(query_lower):
+    """Return and refund policies."""
+    info = []
+    policies = KNOWLEDGE_BASE.get('store_policies', {})
+    if 'return_policy' in policies:
+        policy = policies['return_policy']
+        info.append(f"Return Policy: {policy['timeframe']} - {policy['conditions']}")
+    if 'refund_policy' in policies:
+        refund = policies['refund_policy']
+        info.append(f"Refund Policy: {refund['processing_time']} - {refund['method']}")
+    return info
+
+def _loyalty_program_section(query_lower):
+    """Loyalty program name, benefits and sign-up."""
+    info = []
+    loyalty = KNOWLEDGE_BASE.get('loyalty_program', {})
+    if loyalty:
+        info.append(f"Loyalty Program: {loyalty.get('name', 'CoffeeMarket Rewards')}")
+        if 'benefits' in loyalty:
+            benefits = ', '.join(loyalty['benefits'])
+            info.append(f"Benefits: {benefits}")
+        if 'how_to_join' in loyalty:
+            info.append(f"How to join: {loyalty['how_to_join']}")
+    return info
+
+def _sustainability_section(query_lower):
+    """Sustainability initiatives and certifications."""
+    info = []
+    sustainability = KNOWLEDGE_BASE.get('sustainability', {})
+    if 'initiatives' in sustainability:
+        initiatives = ', '.join(sustainability['initiatives'])
+        info.append(f"Sustainability Initiatives: {initiatives}")
+    if 'certifications' in sustainability:
+        certs = ', '.join(sustainability['certifications'])
+        info.append(f"Certifications: {certs}")
+    return info
+
+def _brewing_guides_section(query_lower):
+    """Brewing guides for methods named in the query."""
+    info = []
+    brewing = KNOWLEDGE_BASE.get('brewing_guides', {})
+    for method, guide in brewing.items():
+        if method in query_lower:
+            info.append(f"{method.title()} Brewing: {guide.get('description', '')}")
+            if 'steps' in guide:
+                steps = '. '.join(guide['steps'])
+                info.append(f"Steps: {steps}")
+    return info
+
+def _equipment_care_section(query_lower):
+    """Care instructions for equipment named in the query."""
+    info = []
+    equipment = KNOWLEDGE_BASE.get('equipment_care', {})
+    for item, care in equipment.items():
+        if item in query_lower or any(keyword in query_lower for keyword in care.get('keywords', [])):
+            info.append(f"{item.title()} Care: {care.get('description', '')}")
+            if 'steps' in care:
+                steps = '. '.join(care['steps'])
+                info.append(f"Cleaning steps: {steps}")
+    return info
+
+# Section handlers in response order; each runs at most once per query
+_KB_SECTION_HANDLERS = {
+    'company_info': _company_info_section,
+    'store_policies': _store_policies_section,
+    'loyalty_program': _loyalty_program_section,
+    'sustainability': _sustainability_section,
+    'brewing_guides': _brewing_guides_section,
+    'equipment_care': _equipment_care_section,
+}
+
+@lru_cache(maxsize=512)
+def _coffeemart_info_impl(query_lower):
+    """Build the knowledge base answer for a normalized query.
+    
+    Results are memoized; call _coffeemart_info_impl.cache_clear() after
+    reloading KNOWLEDGE_BASE.
+    
+    Args:
+        query_lower: Lowercased, stripped customer question
     
     Returns:
         Relevant information from the CoffeeMarket knowledge base
     """
-    query_lower = query.lower()
+    sections = _match_kb_sections(query_lower)
     
-    # Search knowledge base sections for relevant information
+    # Run the handler of every matched knowledge base section
     relevant_info = []
-    
-    # Check company info
-    if any(word in query_lower for word in ['hours', 'location', 'address', 'phone', 'contact']):
-        company_info = KNOWLEDGE_BASE.get('company_info', {})
-        if 'store_hours' in company_info:
-            relevant_info.append(f"Store Hours: {company_info['store_hours']}")
-        if 'locations' in company_info:
-            locations = company_info['locations']
-            for location in locations:
-                relevant_info.append(f"{location['name']}: {location['address']}, Phone: {location['phone']}")
-    
-    # Check policies
-    if any(word in query_lower for word in ['return', 'refund', 'policy', 'exchange', 'warranty']):
-        policies = KNOWLEDGE_BASE.get('store_policies', {})
-        if 'return_policy' in policies:
-            policy = policies['return_policy']
-            relevant_info.append(f"Return Policy: {policy['timeframe']} - {policy['conditions']}")
-        if 'refund_policy' in policies:
-            refund = policies['refund_policy']
-            relevant_info.append(f"Refund Policy: {refund['processing_time']} - {refund['method']}")
-    
-    # Check loyalty program
-    if any(word in query_lower for word in ['loyalty', 'rewards', 'points', 'member']):
-        loyalty = KNOWLEDGE_BASE.get('loyalty_program', {})
-        if loyalty:
-            relevant_info.append(f"Loyalty Program: {loyalty.get('name', 'CoffeeMarket Rewards')}")
-            if 'benefits' in loyalty:
-                benefits = ', '.join(loyalty['benefits'])
-                relevant_info.append(f"Benefits: {benefits}")
-            if 'how_to_join' in loyalty:
-                relevant_info.append(f"How to join: {loyalty['how_to_join']}")
-    
-    # Check sustainability
-    if any(word in query_lower for word in ['sustainability', 'environment', 'eco', 'green', 'organic', 'fair trade']):
-        sustainability = KNOWLEDGE_BASE.get('sustainability', {})
-        if 'initiatives' in sustainability:
-            initiatives = ', '.join(sustainability['initiatives'])
-            relevant_info.append(f"Sustainability Initiatives: {initiatives}")
-        if 'certifications' in sustainability:
-            certs = ', '.join(sustainability['certifications'])
-            relevant_info.append(f"Certifications: {certs}")
-    
-    # Check brewing guides
-    if any(word in query_lower for word in ['brew', 'brewing', 'coffee', 'espresso', 'grind', 'ratio']):
-        brewing = KNOWLEDGE_BASE.get('brewing_guides', {})
-        for method, guide in brewing.items():
-            if method in query_lower:
-                relevant_info.append(f"{method.title()} Brewing: {guide.get('description', '')}")
-                if 'steps' in guide:
-                    steps = '. '.join(guide['steps'])
-                    relevant_info.append(f"Steps: {steps}")
-    
-    # Check equipment care
-    if any(word in query_lower for word in ['clean', 'maintenance', 'care', 'machine', 'grinder']):
-        equipment = KNOWLEDGE_BASE.get('equipment_care', {})
-        for item, care in equipment.items():
-            if item in query_lower or any(keyword in query_lower for keyword in care.get('keywords', [])):
-                relevant_info.append(f"{item.title()} Care: {care.get('description', '')}")
-                if 'steps' in care:
-                    steps = '. '.join(care['steps'])
-                    relevant_info.append(f"Cleaning steps: {steps}")
+    for section, handler in _KB_SECTION_HANDLERS.items():
+        if section in sections:
+            relevant_info.extend(handler(query_lower))
     
     # Fallback to general company information
     if not relevant_info:
@@ -192,7 +325,39 @@ def get_coffeemart_info(query: str) -> str:
 
 
 @tool
-def get_delivery_status(order_number: str, include_details: bool = False) -> str:
+async def get_coffeemart_info(query: str) -> str:
+    """Look up CoffeeMarket information including policies, hours, brewing guides, and company info.
+    
+    Args:
+        query: The customer's question or topic they want information about
+    
+    Returns:
+        Relevant information from the CoffeeMarket knowledge base
+    """
+    return _coffeemart_info_impl(query.lower().strip())
+
+# Delivery message templates, filled from the order record plus its
+# normalized order number and joined item list
+_PROCESSING_TEMPLATE = "Order {order_number} is currently being processed. Expected to ship on {expected_ship}."
+_IN_TRANSIT_TEMPLATE = "Order {order_number} shipped on {shipped_date} and is in transit. Expected delivery: {expected_delivery}."
+_DELIVERED_TEMPLATE = "Order {order_number} was delivered on {delivered_date}."
+_CONFIRMED_TEMPLATE = "Order {order_number} has been confirmed and will ship on {expected_ship}."
+_ITEMS_DETAILS_TEMPLATE = " Items: {items_text}. Total: {total}"
+_TRACKING_DETAILS_TEMPLATE = " Tracking: {tracking_number}. Items: {items_text}. Total: {total}"
+
+# Separators customers put in spoken or typed order numbers ("CM 12345", "cm-12345")
+_ORDER_NUMBER_SEPARATORS = str.maketrans('', '', string.whitespace + '-_')
+
+# Order status -> (summary template, details template)
+_DELIVERY_STATUS_TEMPLATES = {
+    "processing": (_PROCESSING_TEMPLATE, _ITEMS_DETAILS_TEMPLATE),
+    "in_transit": (_IN_TRANSIT_TEMPLATE, _TRACKING_DETAILS_TEMPLATE),
+    "delivered": (_DELIVERED_TEMPLATE, _TRACKING_DETAILS_TEMPLATE),
+    "confirmed": (_CONFIRMED_TEMPLATE, _ITEMS_DETAILS_TEMPLATE),
+}
+
+@tool
+async def get_delivery_status(order_number: str, include_details: bool = False) -> str:
     """Look up delivery status for a customer's order.
     
     Args:
@@ -202,38 +367,24 @@ def get_delivery_status(order_number: str, include_details: bool = False) -> str
     Returns:
         String with delivery status information
     """
-    order_number = order_number.upper().strip()
+    order_number = order_number.translate(_ORDER_NUMBER_SEPARATORS).upper()
     
-    if order_number in DELIVERY_STATUS_DB:
-        order = DELIVERY_STATUS_DB[order_number]
-        status = order["status"]
-        
-        if status == "processing":
-            basic_info = f"Order {order_number} is currently being processed. Expected to ship on {order['expected_ship']}."
-            if include_details:
-                basic_info += f" Items: {', '.join(order['items'])}. Total: {order['total']}"
-            return basic_info
-        elif status == "in_transit":
-            basic_info = f"Order {order_number} shipped on {order['shipped_date']} and is in transit. Expected delivery: {order['expected_delivery']}."
-            if include_details:
-                basic_info += f" Tracking: {order['tracking_number']}. Items: {', '.join(order['items'])}. Total: {order['total']}"
-            return basic_info
-        elif status == "delivered":
-            basic_info = f"Order {order_number} was delivered on {order['delivered_date']}."
-            if include_details:
-                basic_info += f" Tracking: {order['tracking_number']}. Items: {', '.join(order['items'])}. Total: {order['total']}"
-            return basic_info
-        elif status == "confirmed":
-            basic_info = f"Order {order_number} has been confirmed and will ship on {order['expected_ship']}."
-            if include_details:
-                basic_info += f" Items: {', '.join(order['items'])}. Total: {order['total']}"
-            return basic_info
-    else:
-        return f"I couldn't find order {order_number} in our system. Please double-check the order number or contact customer service if you need further assistance."
+    order = DELIVERY_STATUS_DB.get(order_number)
+    templates = _DELIVERY_STATUS_TEMPLATES.get(order["status"]) if order is not None else None
+    
+    if templates is not None:
+        basic_template, details_template = templates
+        fields = ChainMap({'order_number': order_number}, order)
+        basic_info = basic_template.format_map(fields)
+        if include_details:
+            basic_info += details_template.format_map(fields.new_child({'items_text': ', '.join(order['items'])}))
+        return basic_info
+    
+    return f"I couldn't find order {order_number} in our system. Please double-check the order number or contact customer service if you need further assistance."
 
 
 @tool
-def escalate_to_human_agent(reason: str = "Customer requested human assistance") -> str:
+async def escalate_to_human_agent(reason: str = "Customer requested human assistance") -> str:
     """Transfer customer to human agent when they request human assistance.
     
     Use when customers say "I want to speak to a human", "Can I talk to someone?",
@@ -252,8 +403,49 @@ def escalate_to_human_agent(reason: str = "Customer requested human assistance")
     return f"HANDOFF_HUMAN:{message}"
 
 
+# Flavor preference keywords and the (lowercased) flavor notes that satisfy them
+_FLAVOR_KEYWORDS = {
+    'chocolate': frozenset(['chocolate', 'cocoa']),
+    'fruity': frozenset(['berry', 'fruit', 'citrus', 'orange', 'lemon', 'blueberry']),
+    'nutty': frozenset(['nuts', 'nutty', 'almond']),
+    'floral': frozenset(['floral', 'tea-like', 'bergamot']),
+    'spicy': frozenset(['spice', 'spicy', 'cedar']),
+    'sweet': frozenset(['caramel', 'vanilla', 'honey', 'sugar'])
+}
+
+def _flatten_coffees(coffee_db):
+    """Flatten the coffee database into records with precomputed match features.
+    
+    Args:
+        coffee_db: Coffee database content
+    
+    Returns:
+        List of coffee records in database order
+    """
+    coffees = []
+    for category_name, category in coffee_db.get('coffee_beans', {}).items():
+        for coffee_key, coffee in category.items():
+            taste_profile = coffee.get('taste_profile', {})
+            flavor_notes = taste_profile.get('flavor_notes', [])
+            strength = coffee.get('strength', '')
+            strength_lower = strength.lower()
+            coffees.append({
+                'name': coffee.get('name', coffee_key),
+                'description': coffee.get('description', ''),
+                'flavor_notes': flavor_notes,
+                'flavor_notes_lower': frozenset(note.lower() for note in flavor_notes),
+                'strength': strength,
+                'price': coffee.get('price', ''),
+                'brewing_methods': frozenset(coffee.get('brewing_methods', [])),
+                'is_strong': 'strong' in strength_lower or 'full' in taste_profile.get('body', '').lower(),
+                'is_smooth': 'light' in strength_lower or 'medium' in strength_lower
+            })
+    return coffees
+
+_COFFEES = _flatten_coffees(COFFEE_DB)
+
 @tool
-def get_coffee_recommendations(preferences: str) -> str:
+async def get_coffee_recommendations(preferences: str) -> str:
     """Get coffee recommendations based on customer preferences.
     
     Args:
@@ -268,72 +460,57 @@ def get_coffee_recommendations(preferences: str) -> str:
     preferences_lower = preferences.lower()
     recommendations = []
     
+    # Work out which preferences were requested once, not per coffee
+    wants_strong = any(word in preferences_lower for word in ['strong', 'bold', 'intense'])
+    wants_smooth = any(word in preferences_lower for word in ['mild', 'light', 'smooth'])
+    wanted_flavors = [(pref_key, keywords) for pref_key, keywords in _FLAVOR_KEYWORDS.items() if pref_key in preferences_lower]
+    wants_espresso = 'espresso' in preferences_lower
+    wants_french_press = 'french press' in preferences_lower
+    
     # Analyze coffee database for preference matches
-    for category_name, category in COFFEE_DB['coffee_beans'].items():
-        for coffee_key, coffee in category.items():
-            coffee_name = coffee.get('name', coffee_key)
-            description = coffee.get('description', '')
-            taste_profile = coffee.get('taste_profile', {})
-            flavor_notes = taste_profile.get('flavor_notes', [])
-            strength = coffee.get('strength', '')
-            price = coffee.get('price', '')
-            brewing_methods = coffee.get('brewing_methods', [])
-            
-            # Score coffee against customer preferences
-            match_score = 0
-            match_reasons = []
-            
-            # Match strength requirements
-            if any(word in preferences_lower for word in ['strong', 'bold', 'intense']):
-                if 'strong' in strength.lower() or 'full' in taste_profile.get('body', '').lower():
-                    match_score += 3
-                    match_reasons.append("strong flavor")
-            
-            if any(word in preferences_lower for word in ['mild', 'light', 'smooth']):
-                if 'light' in strength.lower() or 'medium' in strength.lower():
-                    match_score += 3
-                    match_reasons.append("smooth taste")
-            
-            # Match flavor profile preferences
-            flavor_keywords = {
-                'chocolate': ['chocolate', 'cocoa'],
-                'fruity': ['berry', 'fruit', 'citrus', 'orange', 'lemon', 'blueberry'],
-                'nutty': ['nuts', 'nutty', 'almond'],
-                'floral': ['floral', 'tea-like', 'bergamot'],
-                'spicy': ['spice', 'spicy', 'cedar'],
-                'sweet': ['caramel', 'vanilla', 'honey', 'sugar']
-            }
-            
-            for pref_key, keywords in flavor_keywords.items():
-                if pref_key in preferences_lower:
-                    if any(keyword.lower() in [note.lower() for note in flavor_notes] for keyword in keywords):
-                        match_score += 2
-                        match_reasons.append(f"{pref_key} notes")
-            
-            # Match brewing method requirements
-            if 'espresso' in preferences_lower and 'Espresso' in brewing_methods:
-                match_score += 2
-                match_reasons.append("great for espresso")
-            
-            if 'french press' in preferences_lower and 'French press' in brewing_methods:
+    for coffee in _COFFEES:
+        # Score coffee against customer preferences
+        match_score = 0
+        match_reasons = []
+        
+        # Match strength requirements
+        if wants_strong and coffee['is_strong']:
+            match_score += 3
+            match_reasons.append("strong flavor")
+        
+        if wants_smooth and coffee['is_smooth']:
+            match_score += 3
+            match_reasons.append("smooth taste")
+        
+        # Match flavor profile preferences
+        for pref_key, keywords in wanted_flavors:
+            if not keywords.isdisjoint(coffee['flavor_notes_lower']):
                 match_score += 2
-                match_reasons.append("perfect for French press")
-            
-            # Include coffee if match score is sufficient
-            if match_score >= 2:
-                recommendations.append({
-                    'name': coffee_name,
-                    'score': match_score,
-                    'reasons': match_reasons,
-                    'description': description,
-                    'flavor_notes': flavor_notes,
-                    'price': price,
-                    'strength': strength
-                })
+                match_reasons.append(f"{pref_key} notes")
+        
+        # Match brewing method requirements
+        if wants_espresso and 'Espresso' in coffee['brewing_methods']:
+            match_score += 2
+            match_reasons.append("great for espresso")
+        
+        if wants_french_press and 'French press' in coffee['brewing_methods']:
+            match_score += 2
+            match_reasons.append("perfect for French press")
+        
+        # Include coffee if match score is sufficient
+        if match_score >= 2:
+            recommendations.append({
+                'name': coffee['name'],
+                'score': match_score,
+                'reasons': match_reasons,
+                'description': coffee['description'],
+                'flavor_notes': coffee['flavor_notes'],
+                'price': coffee['price'],
+                'strength': coffee['strength']
+            })
     
     # Return top 3 recommendations by match score
-    recommendations.sort(key=lambda x: x['score'], reverse=True)
-    top_recommendations = recommendations[:3]
+    top_recommendations = heapq.nlargest(3, recommendations, key=lambda x: x['score'])
     
     if not top_recommendations:
         # Default recommendations if no matches found
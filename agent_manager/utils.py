@@ -1,115 +1,117 @@
 # Agent utility functions for conversation management
-def redact_conversation_history(session_id, utterance_until_interrupt, conversation_histories):
+from utils import setup_logging
+
+logger = setup_logging()
+
+def redact_conversation_history(session_id, utterance_until_interrupt, history, assistant_indices):
     """
     Redact unspoken text from conversation history for meaningful interruptions
     
     Args:
         session_id: Session identifier
         utterance_until_interrupt: Text that was actually spoken before interruption
-        conversation_histories: Dict of conversation histories to update
+        history: Session conversation history to update
+        assistant_indices: Deque of history positions of assistant responses
+            (interstitials are never recorded)
     
     Returns:
         dict: Information about the redaction
     """
-    if session_id not in conversation_histories or not conversation_histories[session_id]:
+    if not history:
         return {"success": False, "message": "No conversation history found"}
     
-    history = conversation_histories[session_id]
-    
-    # Find the most recent assistant message (skip interstitials)
-    for i in range(len(history) - 1, -1, -1):
-        if history[i].get("role") == "assistant":
-            # Skip interstitials - they can't be meaningfully redacted against user speech
-            if history[i].get("type") == "interstitial":
-                print(f"[REDACTION] Skipping interstitial message: '{history[i]['content']}'")
-                continue
-                
-            full_response = history[i]["content"]
-            
-            # Find what portion was actually spoken
-            spoken_portion = find_spoken_portion(full_response, utterance_until_interrupt)
-            
-            if spoken_portion.strip():
-                # Update with spoken portion only
-                redacted_text = full_response[len(spoken_portion):] if len(spoken_portion) < len(full_response) else ""
-                history[i]["content"] = spoken_portion
-                print(f"[REDACTION] Session {session_id}:")
-                print(f"  Original text: '{full_response}'")
-                print(f"  Spoken portion: '{spoken_portion}'")
-                print(f"  Redacted text: '{redacted_text}'")
-            else:
-                # Remove the assistant message entirely if nothing was spoken
-                history.pop(i)
-                print(f"[REDACTION] Session {session_id}:")
-                print(f"  Completely removed unspoken message: '{full_response}'")
-            
-            return {
-                "success": True,
-                "message": "Conversation history redacted",
-                "spoken_text": spoken_portion,
-                "original_text": full_response,
-                "redacted_text": full_response[len(spoken_portion):] if spoken_portion else full_response
-            }
-    
-    return {"success": False, "message": "No assistant message found to redact"}
+    # The most recent assistant response is the last recorded position
+    if not assistant_indices:
+        return {"success": False, "message": "No assistant message found to redact"}
+    
+    i = assistant_indices[-1]
+    full_response = history[i]["content"]
+    
+    # Find what portion was actually spoken
+    spoken_portion = find_spoken_portion(
+        full_response,
+        utterance_until_interrupt,
+        history[i].get("content_lower"),
+        history[i].get("words_lower")
+    )
+    
+    if spoken_portion.strip():
+        # Update with spoken portion only
+        redacted_text = full_response[len(spoken_portion):] if len(spoken_portion) < len(full_response) else ""
+        history[i]["content"] = spoken_portion
+        # Cached lowercase forms no longer match the content
+        history[i].pop("content_lower", None)
+        history[i].pop("words_lower", None)
+        logger.debug(
+            "[REDACTION] Session %s:\n  Original text: '%s'\n  Spoken portion: '%s'\n  Redacted text: '%s'",
+            session_id, full_response, spoken_portion, redacted_text
+        )
+    else:
+        # Remove the assistant message entirely if nothing was spoken; only
+        # later interstitials shift, and those are never recorded
+        history.pop(i)
+        assistant_indices.pop()
+        logger.debug("[REDACTION] Session %s:\n  Completely removed unspoken message: '%s'", session_id, full_response)
+    
+    return {
+        "success": True,
+        "message": "Conversation history redacted",
+        "spoken_text": spoken_portion,
+        "original_text": full_response,
+        "redacted_text": full_response[len(spoken_portion):] if spoken_portion else full_response
+    }
 
 
-def find_spoken_portion(full_text, utterance_until_interrupt):
+def find_spoken_portion(full_text, utterance_until_interrupt, full_lower=None, full_words=None):
     """
     Find the portion of text that was actually spoken based on the utterance.
+    
+    Args:
+        full_text: Complete generated response
+        utterance_until_interrupt: Text that was actually spoken before interruption
+        full_lower: Precomputed full_text.lower(), if available
+        full_words: Precomputed full_text.lower().split(), if available
+    
+    Returns:
+        str: Prefix of full_text that was spoken, or "" if nothing matched
     """
     if not utterance_until_interrupt or not full_text:
         return ""
     
     # Convert both to lowercase for comparison
-    full_lower = full_text.lower()
+    if full_lower is None:
+        full_lower = full_text.lower()
     utterance_lower = utterance_until_interrupt.lower()
     
-    print(f"[REDACTION] Matching utterance: '{utterance_lower}' against text: '{full_lower}'")
-    
     # Try exact substring match first
-    if utterance_lower in full_lower:
+    start_pos = full_lower.find(utterance_lower)
+    if start_pos != -1:
         # Find the end position of the utterance in the original text
-        start_pos = full_lower.find(utterance_lower)
-        end_pos = start_pos + len(utterance_lower)
-        result = full_text[:end_pos]
-        print(f"[REDACTION] Exact match found - returning: '{result}'")
-        return result
+        return full_text[:start_pos + len(utterance_lower)]
     
     # Split into words for word-by-word matching
-    full_words = full_lower.split()
+    if full_words is None:
+        full_words = full_lower.split()
     utterance_words = utterance_lower.split()
     original_words = full_text.split()
     
     if not utterance_words or not full_words:
         return ""
     
-    # Find how many words from the end of utterance match the text
-    best_match_pos = 0
-    for end_pos in range(1, len(full_words) + 1):
-        text_words = full_words[:end_pos]
-        
-        # Check if the utterance ends with the same words as this text segment
-        min_len = min(len(utterance_words), len(text_words))
-        match_count = 0
-        
-        for i in range(min_len):
-            if utterance_words[-(i+1)] == text_words[-(i+1)]:
-                match_count += 1
-            else:
-                break
-        
-        # If we matched all utterance words, this is our best position
-        if match_count == len(utterance_words):
-            best_match_pos = end_pos
-            break
-        elif match_count > 0:
-            best_match_pos = end_pos
+    # Prefer the first place where all utterance words appear consecutively,
+    # searched on space-padded joins so matches fall on word boundaries
+    padded_text = f" {' '.join(full_words)} "
+    char_pos = padded_text.find(f" {' '.join(utterance_words)} ")
+    if char_pos != -1:
+        best_match_pos = padded_text.count(" ", 0, char_pos) + len(utterance_words)
+    elif utterance_words[-1] in full_words:
+        # Otherwise end at the last occurrence of the utterance's final word
+        best_match_pos = len(full_words) - full_words[::-1].index(utterance_words[-1])
+    else:
+        best_match_pos = 0
     
     if best_match_pos > 0:
-        result = ' '.join(original_words[:best_match_pos])
-        print(f"[REDACTION] Word match found at position {best_match_pos} - returning: '{result}'")
-        return result
+        return ' '.join(original_words[:best_match_pos])
     
-    print(f"[REDACTION] Warning: Could not match utterance '{utterance_until_interrupt}' to generated text '{full_text}'")
+    logger.warning("[REDACTION] Could not match utterance '%s' to generated text '%s'", utterance_until_interrupt, full_text)
     return ""
@@ -3,28 +3,90 @@
 # Handles incoming voice calls, TwiML generation, and WebSocket connections
 
 import uvicorn
-import json
+import orjson
+import time
+import asyncio
+from functools import lru_cache
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from twilio.request_validator import RequestValidator
 from twilio.twiml.voice_response import Connect, ConversationRelay, VoiceResponse
 from fastapi import FastAPI, Request, HTTPException, Depends, status
 from fastapi.responses import Response
-from utils import setup_logging
+from utils import setup_logging, stop_queue_listeners
 from conversation import conversationrelay, call_sid_to_session_id, cleanup_session_data
 from constants import HUMAN_SERVICE_OPERATOR_SID, SERVICE_OPERATOR_SID, SERVICE_URL, WELCOME_GREETING, PORT, ENVIRONMENT, TWILIO_AUTH_TOKEN
+from constants import TWILIO_VALIDATION_CACHE_SIZE, TWILIO_VALIDATION_CACHE_TTL, USE_UVLOOP
 from operators import operator_finished_webhook
-from loaders import STT_HINTS
+from loaders import STT_HINTS, SYSTEM_PROMPT
+from agent import warm_up_agents
 
 # Initialize logging and Twilio request validation
 logger = setup_logging()
 validator = RequestValidator(TWILIO_AUTH_TOKEN)
 
+# Recently validated webhook requests: (url, signature, params) -> validation time
+VALIDATED_REQUESTS = OrderedDict()
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Warm up agent components on startup and flush the logs on shutdown.
+    
+    Renders the TwiML for both operator services and runs the thread-pool
+    warm-up off the event loop, so startup stays responsive, before the
+    first call arrives. On shutdown the logging listener threads write out
+    any queued records.
+    
+    Args:
+        app (FastAPI): Application being served
+    """
+    if SERVICE_URL:
+        for intelligence_service_id in (SERVICE_OPERATOR_SID, HUMAN_SERVICE_OPERATOR_SID):
+            render_connect_twiml(intelligence_service_id)
+    await asyncio.to_thread(warm_up_agents, (SYSTEM_PROMPT,))
+    yield
+    stop_queue_listeners()
+
 # Initialize FastAPI application
 app = FastAPI(
     title="CoffeeMarket Voice Assistant",
     description="Twilio ConversationRelay powered voice assistant for CoffeeMarket",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+@lru_cache(maxsize=8)
+def render_connect_twiml(intelligence_service_id):
+    """
+    Render the ConversationRelay TwiML for an operator service.
+    
+    The document only depends on static configuration and the operator
+    service ID, so each variant is built once and reused for every call.
+    
+    Args:
+        intelligence_service_id (str): Twilio operator service ID (AI or human)
+    
+    Returns:
+        str: Serialized TwiML document
+    """
+    domain = SERVICE_URL
+    ws_url = f"wss://{domain}/ws"
+    
+    response = VoiceResponse()
+    connect = Connect(action=f"https://{SERVICE_URL}/session_end")
+    cr = ConversationRelay(
+        url=ws_url,
+        welcomeGreeting=WELCOME_GREETING,
+        hints=STT_HINTS,
+        intelligence_service=intelligence_service_id,
+    )
+
+    connect.append(cr)
+    response.append(connect)
+    
+    return str(response)
+
 def connect_customer(
     call_sid,
     from_number,
@@ -57,24 +119,11 @@ def connect_customer(
         
         logger.info(f"Incoming call - CallSid: {call_sid}, From: {from_number}, To: {to_number}")
         
-        domain = SERVICE_URL
-        ws_url = f"wss://{domain}/ws"
+        twiml = render_connect_twiml(intelligence_service_id)
         
-        response = VoiceResponse()
-        connect = Connect(action=f"https://{SERVICE_URL}/session_end")
-        cr = ConversationRelay(
-            url=ws_url,
-            welcomeGreeting=WELCOME_GREETING,
-            hints=STT_HINTS,
-            intelligence_service=intelligence_service_id,
-        )
-
-        connect.append(cr)
-        response.append(connect)
+        logger.info(f"Generated TwiML for CallSid {call_sid}: {twiml}")
         
-        logger.info(f"Generated TwiML for CallSid {call_sid}: {str(response)}")
-        
-        return Response(content=str(response), media_type="application/xml")
+        return Response(content=twiml, media_type="application/xml")
     except Exception as e:
         logger.error(f"Error in voice_webhook: {e}")
         response = VoiceResponse()
@@ -96,7 +145,7 @@ async def voice_webhook(request: Request):
         Response: TwiML XML response to connect caller to ConversationRelay
     """
 
-    form_data = await request.form()
+    form_data = request.state.form
     call_sid = form_data.get('CallSid', 'Unknown')
     from_number = form_data.get('From', 'Unknown')
     to_number = form_data.get('To', 'Unknown')
@@ -126,7 +175,7 @@ async def session_end(request: Request):
     Returns:
         Response: Either empty response or TwiML for human agent connection
     """
-    response = await request.form()
+    response = request.state.form
     call_sid = response.get("CallSid")
     
     # Clean up conversation data using call_sid to find session_id
@@ -136,7 +185,7 @@ async def session_end(request: Request):
 
     handoff_data = response.get("HandoffData")
     if handoff_data:    
-        reason_block = json.loads(handoff_data)
+        reason_block = orjson.loads(handoff_data)
         reason_code = reason_block.get("reasonCode")
         if reason_code == "live-agent-handoff":
             return connect_customer(
@@ -154,7 +203,8 @@ async def validate_twilio_request(request: Request):
     
     Uses Twilio's request validation to verify the X-Twilio-Signature header.
     This prevents unauthorized access to webhook endpoints by ensuring
-    requests originate from Twilio's servers.
+    requests originate from Twilio's servers. The parsed form is kept on
+    request.state.form so route handlers can reuse it.
     
     Args:
         request (Request): FastAPI request object
@@ -165,11 +215,49 @@ async def validate_twilio_request(request: Request):
     twilio_signature = request.headers.get("X-Twilio-Signature", "")
     url = str(request.url)
     form_data = await request.form()
-    params = dict(form_data)
+    request.state.form = form_data
 
-    if not validator.validate(url, params, twilio_signature):
+    # FormData is passed as-is; the validator reads repeated fields with getlist
+    if not is_valid_twilio_signature(url, form_data, twilio_signature):
         return Response("Unauthorized", status_code=status.HTTP_403_FORBIDDEN)
 
+def is_valid_twilio_signature(url, params, twilio_signature):
+    """
+    Check a Twilio signature, reusing recent results for retried webhooks.
+    
+    Only successful validations are cached. The key covers the URL,
+    signature and every form parameter, so a cached signature can never
+    vouch for different parameters. Entries expire after
+    TWILIO_VALIDATION_CACHE_TTL seconds and the cache holds at most
+    TWILIO_VALIDATION_CACHE_SIZE requests.
+    
+    Args:
+        url (str): Full request URL
+        params (FormData): Submitted form parameters
+        twilio_signature (str): Value of the X-Twilio-Signature header
+    
+    Returns:
+        bool: True if the signature is valid
+    """
+    now = time.monotonic()
+    
+    # Entries are kept in validation order, so expired ones sit at the front
+    while VALIDATED_REQUESTS:
+        key, validated_at = next(iter(VALIDATED_REQUESTS.items()))
+        if len(VALIDATED_REQUESTS) < TWILIO_VALIDATION_CACHE_SIZE and now - validated_at < TWILIO_VALIDATION_CACHE_TTL:
+            break
+        del VALIDATED_REQUESTS[key]
+    
+    cache_key = (url, twilio_signature, frozenset(params.multi_items()))
+    if cache_key in VALIDATED_REQUESTS:
+        return True
+    
+    if not validator.validate(url, params, twilio_signature):
+        return False
+    
+    VALIDATED_REQUESTS[cache_key] = now
+    return True
+
 app.add_api_route("/start", voice_webhook, methods=["POST"], dependencies=[Depends(validate_twilio_request)])
 app.add_api_route("/operator_output", operator_finished_webhook, methods=["POST"], dependencies=[Depends(validate_twilio_request)])
 app.add_api_route("/session_end", session_end, methods=["POST"], dependencies=[Depends(validate_twilio_request)])
@@ -178,12 +266,15 @@ app.add_websocket_route("/ws", conversationrelay)
 if __name__ == "__main__":
     port = int(PORT)
     is_production = ENVIRONMENT == "production"
+    # "auto" picks uvloop when installed and falls back to asyncio otherwise
+    loop = "auto" if USE_UVLOOP else "asyncio"
     
     if is_production:
         uvicorn.run(
             "app:app", 
             host="0.0.0.0", 
             port=port, 
+            loop=loop,
             log_level="info",
             access_log=True
         )
@@ -192,6 +283,7 @@ if __name__ == "__main__":
             "app:app", 
             host="0.0.0.0", 
             port=port, 
+            loop=loop,
             reload=True,
             log_level="debug"
         )
@@ -20,4 +20,14 @@ AZURE_API_KEY = os.getenv("AZURE_API_KEY")
 AZURE_DEPLOYMENT = os.getenv("AZURE_DEPLOYMENT")
 AZURE_API_VERSION = os.getenv("AZURE_API_VERSION")
 
-ENABLE_STREAMING = os.getenv("ENABLE_STREAMING", "True").lower() == "true"
\ No newline at end of file
+ENABLE_STREAMING = os.getenv("ENABLE_STREAMING", "True").lower() == "true"
+
+# Run on uvloop when it is installed (not available on Windows)
+USE_UVLOOP = os.getenv("USE_UVLOOP", "True").lower() == "true"
+
+# Agent session cache limits
+AGENT_SESSION_LIMIT = int(os.getenv("AGENT_SESSION_LIMIT", 256))
+AGENT_SESSION_TTL = float(os.getenv("AGENT_SESSION_TTL", 1800))
+# Twilio signature validation cache limits
+TWILIO_VALIDATION_CACHE_SIZE = int(os.getenv("TWILIO_VALIDATION_CACHE_SIZE", 1024))
+TWILIO_VALIDATION_CACHE_TTL = float(os.getenv("TWILIO_VALIDATION_CACHE_TTL", 60))
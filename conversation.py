@@ -1,10 +1,13 @@
 # Handles Twilio ConversationRelay WebSocket connections and message processing
 import json
-import asyncio
-from typing import Dict, Optional
-from fastapi import WebSocket, WebSocketDisconnect
-from utils import setup_logging, setup_session_logging, setup_conversation_logging, log_conversation_turn, setup_session_conversation_logging
-from llm_handler import llm_call_response_streaming
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+from fastapi import WebSocket
+from utils import setup_logging, setup_session_logging, setup_conversation_logging, log_conversation_turn, setup_session_conversation_logging, close_session_conversation_logging
+from llm_handler import llm_call_response_streaming, encode_text_message
+from agent import release_agent_session
 from loaders import SYSTEM_PROMPT
 from agent_manager.utils import redact_conversation_history
 
@@ -13,19 +16,41 @@ logger = setup_logging()
 session_logger = setup_session_logging()
 conversation_logger = setup_conversation_logging()
 
+# Constant messages sent to ConversationRelay, encoded once
+_UNSUPPORTED_LANGUAGE_MESSAGE = encode_text_message("I'm sorry, I don't understand that language. Please try again in English.", True)
+_CALL_ERROR_MESSAGE = encode_text_message("I'm sorry, there was a technical issue with the call. Please try calling again.", True)
+_CONNECTION_ERROR_MESSAGE = encode_text_message("I'm sorry, there was a technical issue. Please try calling again.", True)
+_END_MESSAGE = '{"type":"end"}'
+
+@dataclass(slots=True)
+class Session:
+    """Per-call state for an active ConversationRelay session."""
+    websocket: WebSocket
+    call_sid: Optional[str]
+    start_time: float
+    conv_logger: Any  # Per-session conversation logger
+    history: list = field(default_factory=list)  # Chat history
+    assistant_indices: deque = field(default_factory=deque)  # Assistant response positions in history
+    call_state: str = 'on_call'
+
+@dataclass(slots=True)
+class Connection:
+    """State of one ConversationRelay WebSocket while its messages are handled."""
+    websocket: WebSocket
+    session_id: Optional[str] = None
+    session: Optional[Session] = None  # Bound at setup
+    closed: bool = False
+
 # Session management
-session_state: Dict[str, Dict] = {}  # Session data by session_id
-connections: Dict[str, WebSocket] = {}  # Active WebSocket connections
-session_conversation_loggers: Dict[str, any] = {}  # Per-session loggers
-conversation_histories: Dict[str, list] = {}  # Chat history by session
+sessions: Dict[str, Session] = {}  # Active sessions by session_id
 call_sid_to_session_id: Dict[str, str] = {}  # Call SID to session mapping
 
 def cleanup_session_data(session_id: str, call_sid: str = None):
     """
     Clean up session data when call ends.
     
-    Removes all session-related data including WebSocket connections,
-    conversation loggers, and session state mappings.
+    Removes the session with its connection, conversation logger and
+    history, plus the call SID mapping.
     
     Args:
         session_id (str): Unique session identifier
@@ -35,48 +60,216 @@ def cleanup_session_data(session_id: str, call_sid: str = None):
         return
     
     # Calculate session duration if available
-    if session_id in session_state:
-        session_duration = asyncio.get_event_loop().time() - session_state[session_id].get('start_time', 0)
+    session = sessions.pop(session_id, None)
+    if session is not None:
+        session_duration = time.perf_counter() - session.start_time
         logger.info(f"Session {session_id} ended after {session_duration:.2f} seconds")
         
-        # Get call_sid from session_state if not provided
+        # Get call_sid from the session if not provided
         if not call_sid:
-            call_sid = session_state[session_id].get('call_sid')
-        
-        del session_state[session_id]
+            call_sid = session.call_sid
     
-    # Clean up other session data
-    if session_id in connections:
-        del connections[session_id]
-    if session_id in session_conversation_loggers:
-        del session_conversation_loggers[session_id]
+    release_agent_session(session_id)
+    close_session_conversation_logging(session_id)
     
     # Remove the mapping if call_sid is available
-    if call_sid and call_sid in call_sid_to_session_id:
-        del call_sid_to_session_id[call_sid]
+    if call_sid:
+        call_sid_to_session_id.pop(call_sid, None)
     
     logger.info(f"Cleaned up session data for {session_id}" + (f" (call_sid: {call_sid})" if call_sid else ""))
 
+async def _handle_setup(conn, data):
+    """
+    Initialize the session on the first message of a connection.
+    
+    Args:
+        conn (Connection): Connection the message arrived on
+        data (dict): Parsed setup message
+    """
+    session_id = conn.session_id = data.get("sessionId")
+    call_sid = data.get("callSid")
+    conn.session = None
+    
+    if not session_id:
+        logger.error("Setup message missing sessionId")
+        return
+        
+    # Store connection, session state and per-session conversation logger
+    session_conv_logger = setup_session_conversation_logging(session_id, call_sid)
+    sessions[session_id] = conn.session = Session(
+        websocket=conn.websocket,
+        call_sid=call_sid,
+        start_time=time.perf_counter(),
+        conv_logger=session_conv_logger
+    )
+    call_sid_to_session_id[call_sid] = session_id
+    
+    logger.info(f"Session {session_id} initialized with call_sid {call_sid}")
+    session_logger.info(
+        f"Session started",
+        extra={'session_id': session_id, 'call_sid': call_sid}
+    )
+    
+    # Log conversation start
+    log_conversation_turn(session_id, call_sid, "SYSTEM", "Conversation started", conversation_logger)
+    session_conv_logger.info("Conversation started", extra={'speaker': 'SYSTEM'})
+
+async def _handle_prompt(conn, data):
+    """
+    Handle user voice input by streaming the agent's response.
+    
+    Args:
+        conn (Connection): Connection the message arrived on
+        data (dict): Parsed prompt message
+    """
+    session_id = conn.session_id
+    session = conn.session
+    if session is None:
+        logger.error("Received prompt without session setup")
+        return
+        
+    voice_prompt = data.get("voicePrompt", "")
+    lang = data.get("lang", "en-US")
+
+    if not lang.startswith("en"):
+        logger.warning(f"Unsupported language: {lang}")
+        await conn.websocket.send_text(_UNSUPPORTED_LANGUAGE_MESSAGE)
+        return
+    
+    # Validate input
+    if not voice_prompt.strip():
+        logger.warning(f"Empty voice prompt received for session {session_id}")
+        return
+    
+    text = voice_prompt.strip()
+    logger.info(f"Session {session_id} received prompt: '{text}'")
+    
+    # Log user input and process with AI agent
+    call_sid = session.call_sid
+    session_logger.info(
+        f"Customer input: '{text}'",
+        extra={'session_id': session_id, 'call_sid': call_sid}
+    )
+    log_conversation_turn(session_id, call_sid, "USER", text, conversation_logger)
+    session.conv_logger.info(text, extra={'speaker': 'USER'})
+    await llm_call_response_streaming(conn.websocket, session_id, text, session, session_logger, SYSTEM_PROMPT, conversation_logger)
+
+async def _handle_interrupt(conn, data):
+    """
+    Handle a user interruption by redacting unspoken response text.
+    
+    Args:
+        conn (Connection): Connection the message arrived on
+        data (dict): Parsed interrupt message
+    """
+    session_id = conn.session_id
+    session = conn.session
+    if session is None:
+        logger.error("Received interrupt without session setup")
+        return
+    
+    utterance = data.get("utteranceUntilInterrupt", "")
+    duration_ms = data.get("durationUntilInterruptMs", 0)
+
+    logger.info(f"Session {session_id} interrupted. Utterance: '{utterance}', Duration: {duration_ms}ms")
+    
+    # Log the interruption
+    call_sid = session.call_sid
+    session_logger.info(
+        f"User interrupted. Spoken: '{utterance}', Duration: {duration_ms}ms",
+        extra={'session_id': session_id, 'call_sid': call_sid}
+    )
+
+    redaction_result = redact_conversation_history(session_id, utterance, session.history, session.assistant_indices)
+    
+    if redaction_result["success"]:
+        logger.info(f"Conversation history redacted for session {session_id}")
+    else:
+        logger.warning(f"Failed to redact conversation history for session {session_id}: {redaction_result['message']}")
+
+async def _handle_error(conn, data):
+    """
+    Handle a Twilio error by apologizing, ending the call and closing the connection.
+    
+    Args:
+        conn (Connection): Connection the message arrived on
+        data (dict): Parsed error message
+    """
+    session_id = conn.session_id
+    websocket = conn.websocket
+    error_description = data.get('description', 'Unknown error')
+    logger.error(f"Error received for session {session_id}: {error_description}")
+    
+    # Log to session logger if available
+    session = conn.session
+    if session is not None:
+        call_sid = session.call_sid
+        session_logger.error(
+            f"Twilio error: {error_description}",
+            extra={'session_id': session_id, 'call_sid': call_sid}
+        )
+    
+    try:
+        await websocket.send_text(_CALL_ERROR_MESSAGE)
+    except Exception as send_error:
+        logger.error(f"Failed to send error message to session {session_id}: {send_error}")
+    
+    # Send end message to terminate the call
+    try:
+        await websocket.send_text(_END_MESSAGE)
+        logger.info(f"Sent end message for error in session {session_id}")
+    except Exception as end_error:
+        logger.error(f"Failed to send end message to session {session_id}: {end_error}")
+
+    if session_id:
+        cleanup_session_data(session_id)
+    
+    try:
+        await websocket.close()
+    except Exception as close_error:
+        logger.error(f"Failed to close WebSocket for session {session_id}: {close_error}")
+    
+    # Exit the message loop since connection is closed
+    conn.closed = True
+
+async def _handle_unknown(conn, data):
+    """
+    Log a message type this handler does not support.
+    
+    Args:
+        conn (Connection): Connection the message arrived on
+        data (dict): Parsed message
+    """
+    logger.warning(f"Unknown message type '{data.get('type')}' from session {conn.session_id}")
+
+# ConversationRelay message type -> handler
+MESSAGE_HANDLERS = {
+    "setup": _handle_setup,
+    "prompt": _handle_prompt,
+    "interrupt": _handle_interrupt,
+    "error": _handle_error,
+}
+
 async def conversationrelay(websocket: WebSocket):
     """
     Handle Twilio ConversationRelay WebSocket messages.
     
     Main WebSocket handler that processes incoming messages from Twilio's
-    ConversationRelay service. Manages session setup, user voice prompts,
-    interruptions, and error handling.
+    ConversationRelay service. Each message is dispatched by type to its
+    handler in MESSAGE_HANDLERS.
     
     Args:
         websocket (WebSocket): Active WebSocket connection from Twilio
     """
     await websocket.accept()
-    session_id: Optional[str] = None
+    conn = Connection(websocket=websocket)
     
     logger.info("WebSocket connection established")
 
     try:
-        while True:
-            msg = await websocket.receive_text()
-            logger.debug(f"Received raw message: {msg}")
+        # Ends cleanly when Twilio disconnects
+        async for msg in websocket.iter_text():
+            logger.debug("Received raw message: %s", msg)
             
             try:
                 data = json.loads(msg)
@@ -85,167 +278,24 @@ async def conversationrelay(websocket: WebSocket):
                 continue
                 
             typ = data.get("type")
-            logger.debug(f"Message type: {typ}")
-
-            # Initialize session on first connection
-            if typ == "setup":
-                session_id = data.get("sessionId")
-                call_sid = data.get("callSid")
-                
-                if not session_id:
-                    logger.error("Setup message missing sessionId")
-                    continue
-                    
-                # Store connection and session state
-                connections[session_id] = websocket
-                session_state[session_id] = {
-                    'call_sid': call_sid,
-                    'call_state': 'on_call',
-                    'start_time': asyncio.get_event_loop().time()
-                }
-                call_sid_to_session_id[call_sid] = session_id
-
-                # Setup per-session conversation logger
-                session_conv_logger = setup_session_conversation_logging(session_id, call_sid)
-                session_conversation_loggers[session_id] = session_conv_logger
-                
-                logger.info(f"Session {session_id} initialized with call_sid {call_sid}")
-                session_logger.info(
-                    f"Session started",
-                    extra={'session_id': session_id, 'call_sid': call_sid}
-                )
-                
-                # Log conversation start
-                log_conversation_turn(session_id, call_sid, "SYSTEM", "Conversation started", conversation_logger)
-                session_conv_logger.info("Conversation started", extra={'speaker': 'SYSTEM'})
-                
-            # Handle user voice input
-            elif typ == "prompt":
-                if not session_id:
-                    logger.error("Received prompt without session setup")
-                    continue
-                    
-                voice_prompt = data.get("voicePrompt", "")
-                lang = data.get("lang", "en-US")
-
-                if "en" not in lang:
-                    logger.warning(f"Unsupported language: {lang}")
-                    await websocket.send_json({
-                        "type": "text",
-                        "token": "I'm sorry, I don't understand that language. Please try again in English.",
-                        "lang": "en-US",
-                        "last": True
-                    })
-                    continue
-                
-                # Validate input
-                if not voice_prompt.strip():
-                    logger.warning(f"Empty voice prompt received for session {session_id}")
-                    continue
-                
-                text = voice_prompt.strip()
-                logger.info(f"Session {session_id} received prompt: '{text}'")
-                
-                # Log user input and process with AI agent
-                call_sid = session_state.get(session_id, {}).get('call_sid', 'unknown')
-                session_logger.info(
-                    f"Customer input: '{text}'",
-                    extra={'session_id': session_id, 'call_sid': call_sid}
-                )
-                log_conversation_turn(session_id, call_sid, "USER", text, conversation_logger)
-                if session_id in session_conversation_loggers:
-                    session_conversation_loggers[session_id].info(text, extra={'speaker': 'USER'})
-                    await llm_call_response_streaming(websocket, session_id, text, session_state, session_logger, SYSTEM_PROMPT, conversation_histories, conversation_logger, session_conversation_loggers.get(session_id), session_state.get(session_id))
-
-            # Handle user interruptions
-            elif typ == "interrupt":
-                if not session_id:
-                    logger.error("Received interrupt without session setup")
-                    continue
-                
-                utterance = data.get("utteranceUntilInterrupt", "")
-                duration_ms = data.get("durationUntilInterruptMs", 0)
-
-                logger.info(f"Session {session_id} interrupted. Utterance: '{utterance}', Duration: {duration_ms}ms")
-                
-                # Log the interruption
-                call_sid = session_state.get(session_id, {}).get('call_sid', 'unknown')
-                session_logger.info(
-                    f"User interrupted. Spoken: '{utterance}', Duration: {duration_ms}ms",
-                    extra={'session_id': session_id, 'call_sid': call_sid}
-                )
-
-                redaction_result = redact_conversation_history(session_id, utterance, conversation_histories)
-                
-                if redaction_result["success"]:
-                    logger.info(f"Conversation history redacted for session {session_id}")
-                else:
-                    logger.warning(f"Failed to redact conversation history for session {session_id}: {redaction_result['message']}")
-
-            # Handle error messages
-            elif typ == "error":
-                error_description = data.get('description', 'Unknown error')
-                logger.error(f"Error received for session {session_id}: {error_description}")
-                
-                # Log to session logger if available
-                if session_id and session_id in session_state:
-                    call_sid = session_state.get(session_id, {}).get('call_sid', 'unknown')
-                    session_logger.error(
-                        f"Twilio error: {error_description}",
-                        extra={'session_id': session_id, 'call_sid': call_sid}
-                    )
-                
-                try:
-                    await websocket.send_json({
-                        "type": "text",
-                        "token": "I'm sorry, there was a technical issue with the call. Please try calling again.",
-                        "lang": "en-US",
-                        "last": True
-                    })
-                except Exception as send_error:
-                    logger.error(f"Failed to send error message to session {session_id}: {send_error}")
-                
-                # Send end message to terminate the call
-                try:
-                    await websocket.send_json({
-                        "type": "end"
-                    })
-                    logger.info(f"Sent end message for error in session {session_id}")
-                except Exception as end_error:
-                    logger.error(f"Failed to send end message to session {session_id}: {end_error}")
-
-                if session_id:
-                    call_sid = session_state.get(session_id, {}).get('call_sid')
-                    cleanup_session_data(session_id, call_sid)
-                
-                try:
-                    await websocket.close()
-                except Exception as close_error:
-                    logger.error(f"Failed to close WebSocket for session {session_id}: {close_error}")
-                
-                # Exit the message loop since connection is closed
+            logger.debug("Message type: %s", typ)
+            
+            await MESSAGE_HANDLERS.get(typ, _handle_unknown)(conn, data)
+            if conn.closed:
                 break
-                    
-            else:
-                logger.warning(f"Unknown message type '{typ}' from session {session_id}")
-
-    except WebSocketDisconnect:
-        logger.info(f"WebSocket disconnected: {session_id}")
+        else:
+            # Only a normal disconnect; an error that closed the call was logged by its handler
+            logger.info(f"WebSocket disconnected: {conn.session_id}")
 
     except Exception as e:
-        logger.error(f"WebSocket error for session {session_id}: {e}")
+        logger.error(f"WebSocket error for session {conn.session_id}: {e}")
         # Try to send error message if connection is still active
         try:
-            await websocket.send_json({
-                "type": "text",
-                "token": "I'm sorry, there was a technical issue. Please try calling again.",
-                "lang": "en-US",
-                "last": True
-            })
+            await websocket.send_text(_CONNECTION_ERROR_MESSAGE)
         except:
             pass  # Connection might be closed
 
     finally:
         # Clean up session data
-        if session_id:
-            cleanup_session_data(session_id)
\ No newline at end of file
+        if conn.session_id:
+            cleanup_session_data(conn.session_id)
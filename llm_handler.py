@@ -1,6 +1,7 @@
 """Handles streaming LLM responses and WebSocket communication with Twilio."""
 import asyncio
-from typing import Dict
+import logging
+import orjson
 from fastapi import WebSocket
 from agent import  generate_agent_response_stream
 from utils import setup_logging
@@ -8,6 +9,42 @@ from utils import log_conversation_turn
 
 logger = setup_logging()
 
+# Fixed text-message envelope around the JSON-encoded token
+_TEXT_MESSAGE_PREFIX = '{"type":"text","token":'
+_TEXT_MESSAGE_SUFFIX = ',"lang":"en-US","last":false}'
+_TEXT_MESSAGE_LAST_SUFFIX = ',"lang":"en-US","last":true}'
+
+def encode_text_message(token, last):
+    """Encode a ConversationRelay text message.
+    
+    Produces the same JSON as send_json would for the fixed
+    type/token/lang/last message, but only the token is serialized.
+    
+    Args:
+        token (str): Text to speak
+        last (bool): Whether this is the final token of the response
+    
+    Returns:
+        str: JSON message, ready for websocket.send_text
+    """
+    suffix = _TEXT_MESSAGE_LAST_SUFFIX if last else _TEXT_MESSAGE_SUFFIX
+    return _TEXT_MESSAGE_PREFIX + orjson.dumps(token).decode() + suffix
+
+# Marker the agent emits before a human handoff message
+_HANDOFF_MARKER = "HANDOFF_HUMAN:"
+
+# Punctuation that flushes buffered tokens to speech
+_SPEECH_BREAKS = frozenset(".!?,;:")
+
+# Constant messages, encoded once
+_COMPLETION_MESSAGE = encode_text_message("", True)
+_FALLBACK_MESSAGE = encode_text_message("I'm sorry, I'm having trouble processing your request right now. Please try again.", True)
+_END_MESSAGE = orjson.dumps({"type": "end"}).decode()
+_HANDOFF_MESSAGE = orjson.dumps({
+    "type": "end",
+    "handoffData": "{\"reasonCode\":\"live-agent-handoff\", \"reason\":\"Escalation to Human Agent\"}"
+}).decode()
+
 async def end_call(websocket: WebSocket):
     """End the call gracefully.
     
@@ -17,9 +54,7 @@ async def end_call(websocket: WebSocket):
     Args:
         websocket (WebSocket): Active WebSocket connection to Twilio
     """
-    await websocket.send_json({
-        "type": "end",
-    })
+    await websocket.send_text(_END_MESSAGE)
 
 async def human_agent_handoff(websocket: WebSocket):
     """Handle handoff to human agent.
@@ -30,12 +65,9 @@ async def human_agent_handoff(websocket: WebSocket):
     Args:
         websocket (WebSocket): Active WebSocket connection to Twilio
     """
-    await websocket.send_json({
-        "type": "end",
-        "handoffData": "{\"reasonCode\":\"live-agent-handoff\", \"reason\":\"Escalation to Human Agent\"}"
-    })
+    await websocket.send_text(_HANDOFF_MESSAGE)
 
-async def llm_call_response_streaming(websocket: WebSocket, session_id: str, text: str, flow_state: Dict, session_logger, system_prompt, conversation_histories, conversation_logger=None, session_conv_logger=None, session_state=None):
+async def llm_call_response_streaming(websocket: WebSocket, session_id: str, text: str, session, session_logger, system_prompt, conversation_logger=None):
     """Stream LLM response to WebSocket with real-time token delivery.
     
     Processes user input through the AI agent and streams the response
@@ -45,46 +77,64 @@ async def llm_call_response_streaming(websocket: WebSocket, session_id: str, tex
         websocket (WebSocket): Active WebSocket connection to Twilio
         session_id (str): Unique session identifier
         text (str): User input to process
-        flow_state (Dict): Current session state data
+        session (Session): Session state, conversation logger and history
         session_logger: Logger for session-specific events
         system_prompt (str): System instructions for the agent
-        conversation_histories (Dict): Session conversation histories
         conversation_logger: Logger for conversation events
-        session_conv_logger: Per-session conversation logger
-        session_state (Dict): Additional session metadata
     """
     try:
-        call_sid = flow_state.get(session_id, {}).get('call_sid', 'unknown')
+        call_sid = session.call_sid
         full_response_parts = []
         should_end_call = False
         should_handoff = False
         end_call_logged = False
         handoff_logged = False
+        response_completed = False
         
-        # Buffer tokens for optimal streaming
+        # Offset of the first handoff marker in the streamed text, found as chunks arrive;
+        # marker_tail keeps enough text to catch a marker split across chunks
+        handoff_offset = None
+        marker_tail = ""
+        streamed_length = 0
+        
+        # Buffer tokens for optimal streaming, counting buffered words as chunks arrive
         token_buffer = ""
+        words_in_buffer = 0
+        buffer_ends_in_word = False
         
-        async for chunk_data in generate_agent_response_stream(session_id, text, system_prompt, conversation_histories):
-            chunk = chunk_data["chunk"]
-            is_final = chunk_data["is_final"]
-            chunk_should_end_call = chunk_data["should_end_call"]
-            chunk_should_handoff = chunk_data.get("should_handoff", False)
-            is_interstitial = chunk_data.get("is_interstitial", False)
+        async for chunk_data in generate_agent_response_stream(session_id, text, system_prompt, session.history, session.assistant_indices):
+            chunk = chunk_data.chunk
+            is_final = chunk_data.is_final
+            chunk_should_end_call = chunk_data.should_end_call
+            chunk_should_handoff = chunk_data.should_handoff
+            is_interstitial = chunk_data.is_interstitial
             
             # Send quick responses immediately
             if is_interstitial:
-                await websocket.send_json({
-                    "type": "text",
-                    "token": chunk,
-                    "lang": "en-US",
-                    "last": True
-                })
-                logger.debug(f"Sent interstitial to session {session_id}: '{chunk}'")
+                await websocket.send_text(encode_text_message(chunk, True))
+                logger.debug("Sent interstitial to session %s: '%s'", session_id, chunk)
                 continue
             
             full_response_parts.append(chunk)
             token_buffer += chunk
             
+            if handoff_offset is None:
+                window = marker_tail + chunk
+                marker_pos = window.find(_HANDOFF_MARKER)
+                if marker_pos != -1:
+                    handoff_offset = streamed_length - len(marker_tail) + marker_pos
+                else:
+                    marker_tail = window[-(len(_HANDOFF_MARKER) - 1):]
+            streamed_length += len(chunk)
+            
+            # A chunk that continues the buffer's last word adds no new word
+            chunk_words = len(chunk.split())
+            if chunk_words and buffer_ends_in_word and not chunk[0].isspace():
+                chunk_words -= 1
+            words_in_buffer += chunk_words
+            if chunk:
+                buffer_ends_in_word = not chunk[-1].isspace()
+            
             # Track call state changes
             if chunk_should_end_call and not end_call_logged:
                 should_end_call = True
@@ -95,75 +145,57 @@ async def llm_call_response_streaming(websocket: WebSocket, session_id: str, tex
                 handoff_logged = True
                 logger.info(f"DEBUG: should_handoff detected for session {session_id}")
             
-            # Batch tokens for natural speech
-            words_in_buffer = len(token_buffer.strip().split())
-            
-            # Send on word count or punctuation
+            # Batch tokens for natural speech; send on word count or punctuation
             should_send = (
                 is_final or 
                 words_in_buffer >= 3 or 
-                chunk.strip().endswith(('.', '!', '?', ',', ';', ':'))
+                chunk.rstrip()[-1:] in _SPEECH_BREAKS
             )
             
-            if should_send and token_buffer.strip():
+            if should_send and words_in_buffer:
                 # Validate chunk length
                 send_chunk = token_buffer
                 if len(send_chunk) > 200:
                     send_chunk = send_chunk[:197] + "..."
                     logger.warning(f"Chunk truncated for session {session_id}")
                 
-                # Stream to ConversationRelay
-                await websocket.send_json({
-                    "type": "text",
-                    "token": send_chunk,
-                    "lang": "en-US",
-                    "last": False  # Never set last=True here, handle it separately - cannot properly due to Langchain
-                })
+                # Stream to ConversationRelay; the final chunk also completes the response
+                await websocket.send_text(encode_text_message(send_chunk, is_final))
+                response_completed = is_final
                 
-                logger.debug(f"Sent chunk to session {session_id}: '{send_chunk.strip()}' (should_end_call: {chunk_should_end_call})")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Sent chunk to session %s: '%s' (should_end_call: %s)", session_id, send_chunk.strip(), chunk_should_end_call)
                 
                 # Clear buffer
                 token_buffer = ""
+                words_in_buffer = 0
+                buffer_ends_in_word = False
         
-        # Send remaining tokens and completion
-        if token_buffer.strip():
-            # Send remaining tokens
-            await websocket.send_json({
-                "type": "text",
-                "token": token_buffer,
-                "lang": "en-US",
-                "last": False
-            })
-            logger.debug(f"Sent final buffered tokens to session {session_id}: '{token_buffer.strip()}'")
-        
-        # Send final completion message
-        await websocket.send_json({
-            "type": "text",
-            "token": "",
-            "lang": "en-US",
-            "last": True
-        })
-        logger.debug(f"Sent final completion message to session {session_id}")
+        # Complete the response in a single frame: remaining tokens with last=True,
+        # or an empty completion message if the final chunk did not already do it
+        if words_in_buffer:
+            await websocket.send_text(encode_text_message(token_buffer, True))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Sent final buffered tokens to session %s: '%s'", session_id, token_buffer.strip())
+        elif not response_completed:
+            await websocket.send_text(_COMPLETION_MESSAGE)
+            logger.debug("Sent final completion message to session %s", session_id)
         
         # Log complete response
         full_response = "".join(full_response_parts)
         logger.info(f"Sent streaming response to session {session_id}: '{full_response[:100]}...'")
         
-        # Fallback handoff detection - check for marker in response text
-        if not should_handoff and "HANDOFF_HUMAN:" in full_response:
+        # Fallback handoff detection - use the marker found in the response text
+        if not should_handoff and handoff_offset is not None:
             should_handoff = True
             # Extract the message part after the marker
-            handoff_parts = full_response.split("HANDOFF_HUMAN:", 1)
-            if len(handoff_parts) > 1:
-                full_response = handoff_parts[1].strip()
-                logger.info(f"Human agent handoff detected via string parsing for session {session_id}")
+            full_response = full_response[handoff_offset + len(_HANDOFF_MARKER):].strip()
+            logger.info(f"Human agent handoff detected via string parsing for session {session_id}")
         elif should_handoff:
             logger.info(f"Human agent handoff detected via streaming for session {session_id}")
             # Also clean the response if it contains the marker
-            if "HANDOFF_HUMAN:" in full_response:
-                handoff_parts = full_response.split("HANDOFF_HUMAN:", 1)
-                if len(handoff_parts) > 1:
-                    full_response = handoff_parts[1].strip()
+            if handoff_offset is not None:
+                full_response = full_response[handoff_offset + len(_HANDOFF_MARKER):].strip()
         
         session_logger.info(
             f"AI streaming response: '{full_response}' (Call ending: {should_end_call}, Handoff: {should_handoff})",
@@ -174,8 +206,7 @@ async def llm_call_response_streaming(websocket: WebSocket, session_id: str, tex
         if conversation_logger:
             log_conversation_turn(session_id, call_sid, "AGENT", full_response, conversation_logger)
         
-        if session_conv_logger:
-            session_conv_logger.info(full_response, extra={'speaker': 'AGENT'})
+        session.conv_logger.info(full_response, extra={'speaker': 'AGENT'})
         
         # Execute call actions with speech timing
         if should_handoff:
@@ -206,9 +237,4 @@ async def llm_call_response_streaming(websocket: WebSocket, session_id: str, tex
     except Exception as e:
         logger.error(f"Error generating streaming LLM response for session {session_id}: {e}")
         # Send fallback response
-        await websocket.send_json({
-            "type": "text",
-            "token": "I'm sorry, I'm having trouble processing your request right now. Please try again.",
-            "lang": "en-US",
-            "last": True
-        })
+        await websocket.send_text(_FALLBACK_MESSAGE)
@@ -1,5 +1,7 @@
 """Data loaders for knowledge bases, databases, and configuration files."""
-import json
+from pathlib import Path
+
+import orjson
 from utils import setup_logging
 
 logger = setup_logging()
@@ -11,9 +13,7 @@ def load_stt_hints():
         str: Hints content for STT processing, empty string if file not found
     """
     try:
-        with open('stt_hints.txt', 'r', encoding='utf-8') as f:
-            hints_content = f.read().strip()
-            return hints_content
+        return Path('stt_hints.txt').read_text(encoding='utf-8').strip()
     except FileNotFoundError:
         logger.warning("stt_hints.txt not found, using empty hints")
         return ""
@@ -28,8 +28,8 @@ def load_coffee_database():
         dict: Coffee database content, empty dict if file not found
     """
     try:
-        with open('knowledge/coffee_database.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open('knowledge/coffee_database.json', 'rb') as f:
+            return orjson.loads(f.read())
     except FileNotFoundError:
         print("Warning: knowledge/coffee_database.json not found")
         return {}
@@ -44,8 +44,8 @@ def load_knowledge_base():
         dict: Knowledge base content, empty dict if file not found
     """
     try:
-        with open('knowledge/coffeemart_knowledge_base.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open('knowledge/coffeemart_knowledge_base.json', 'rb') as f:
+            return orjson.loads(f.read())
     except FileNotFoundError:
         print("Warning: knowledge/coffeemart_knowledge_base.json not found")
         return {}
@@ -56,12 +56,15 @@ def load_knowledge_base():
 def load_delivery_status_db():
     """Load delivery status database from JSON file.
     
+    Order numbers are uppercased once here so lookups only need to
+    normalize the caller's input.
+    
     Returns:
         dict: Delivery status data, empty dict if file not found
     """
     try:
-        with open('store/delivery_status.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open('store/delivery_status.json', 'rb') as f:
+            return {order_number.upper(): order for order_number, order in orjson.loads(f.read()).items()}
     except FileNotFoundError:
         print("Warning: store/delivery_status.json not found")
         return {}
@@ -76,8 +79,8 @@ def load_inventory_db():
         dict: Inventory data, empty dict if file not found
     """
     try:
-        with open('store/inventory.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open('store/inventory.json', 'rb') as f:
+            return orjson.loads(f.read())
     except FileNotFoundError:
         print("Warning: store/inventory.json not found")
         return {}
@@ -92,8 +95,7 @@ def load_system_prompt():
         str: System prompt content, default prompt if file not found
     """
     try:
-        with open('prompt.txt', 'r', encoding='utf-8') as f:
-            return f.read().strip()
+        return Path('prompt.txt').read_text(encoding='utf-8').strip()
     except FileNotFoundError:
         logger.warning("prompt.txt not found, using default prompt")
         return "You are a helpful CoffeeMarket customer service assistant."
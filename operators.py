@@ -1,5 +1,7 @@
 """Handles Twilio Intelligence operator webhooks and result processing."""
+import asyncio
 from pathlib import Path
+from functools import lru_cache
 from twilio.rest import Client
 from fastapi import Request
 from constants import TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN
@@ -7,6 +9,32 @@ from utils import setup_logging
 
 logger = setup_logging()
 
+@lru_cache(maxsize=1)
+def _get_twilio_client():
+    """Return the shared Twilio REST client.
+    
+    A single client keeps its HTTP session, so connections to the Twilio
+    API are reused across webhooks.
+    
+    Returns:
+        Client: Twilio REST client
+    """
+    return Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+
+def _fetch_operator_results(transcript_id):
+    """Fetch a transcript's operator results from Twilio Intelligence.
+    
+    Uses the blocking REST client, so call it from a worker thread.
+    
+    Args:
+        transcript_id (str): Twilio Intelligence transcript SID
+    
+    Returns:
+        list: Operator results for the transcript
+    """
+    transcript = _get_twilio_client().intelligence.v2.transcripts(transcript_id).fetch()
+    return transcript.operator_results.list()
+
 async def operator_finished_webhook(request: Request):
     """Handle Twilio Intelligence operator completion webhook.
     
@@ -22,9 +50,8 @@ async def operator_finished_webhook(request: Request):
 
     transcript_id = response.get('transcript_sid')
 
-    client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-    transcript = client.intelligence.v2.transcripts(transcript_id).fetch()
-    operator_results = transcript.operator_results.list()
+    # The Twilio client is synchronous; keep its requests off the event loop
+    operator_results = await asyncio.to_thread(_fetch_operator_results, transcript_id)
 
     # Process each operator result
     for res in operator_results:
@@ -46,8 +73,7 @@ async def operator_finished_webhook(request: Request):
 
                 final_result = text_results["result"]
                 
-                with open(output_file, "w") as f:
-                    f.write(final_result)
+                await asyncio.to_thread(output_file.write_text, final_result)
                 
                 # try:
                 #     jsoned = final_result
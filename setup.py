@@ -1,65 +1,70 @@
 #!/usr/bin/env python3
+import os
 import sys
+import shutil
+import threading
 import subprocess
 import platform
 from pathlib import Path
 
+MIN_PYTHON = (3, 10)  # Slotted dataclasses (Session, Connection, StreamChunk) need 3.10
+MIN_PIP = '23.1'  # Older venv pips are upgraded to at least this version
+SYSTEM = platform.system().lower()  # Looked up once; 'windows', 'linux', 'darwin', ...
+
 def run_command(command, cwd=None, shell=False):
-    """Run a command and handle errors gracefully."""
+    """Run a command and handle errors gracefully.
+    
+    The command inherits this process's stdout and stderr, so its
+    output (and pip's progress bars) appears as it runs.
+    """
     try:
-        print(f"Running: {' '.join(command) if isinstance(command, list) else command}")
-        result = subprocess.run(
+        print(f"Running: {' '.join(command) if isinstance(command, list) else command}", flush=True)
+        subprocess.run(
             command,
             cwd=cwd,
             shell=shell,
-            check=True,
-            capture_output=True,
-            text=True
+            check=True
         )
-        if result.stdout:
-            print(result.stdout)
         return True
     except subprocess.CalledProcessError as e:
         print(f"Error running command: {e}")
-        if e.stderr:
-            print(f"Error output: {e.stderr}")
         return False
 
 
 def get_python_executable():
-    """Get the appropriate Python executable for the current platform."""
+    """Get the appropriate Python executable for the current platform.
+    
+    Prefers the interpreter running this script, which is known to work.
+    Otherwise searches PATH, skipping the Microsoft Store stubs in
+    WindowsApps that exit without running anything.
+    """
+    if sys.executable:
+        return sys.executable
+    
     python_names = ['python3', 'python', 'py']
     
     for name in python_names:
-        try:
-            result = subprocess.run([name, '--version'], capture_output=True, text=True)
-            if result.returncode == 0:
-                return name
-        except FileNotFoundError:
-            continue
-    
-    # Fallback to sys.executable
-    return sys.executable
+        path = shutil.which(name)
+        if path and 'windowsapps' not in path.lower():
+            return path
+    
+    return None
 
 
 def get_venv_activation_command():
     """Get the virtual environment activation command for the current OS."""
-    system = platform.system().lower()
-    
-    if system == 'windows':
+    if SYSTEM == 'windows':
         return ['.venv\\Scripts\\activate.bat']
     else: 
         return ['source', '.venv/bin/activate']
 
 
-def get_pip_executable():
-    """Get the pip executable path within the virtual environment."""
-    system = platform.system().lower()
-    
-    if system == 'windows':
-        return '.venv\\Scripts\\pip.exe'
+def get_venv_python():
+    """Get the Python executable path within the virtual environment."""
+    if SYSTEM == 'windows':
+        return '.venv\\Scripts\\python.exe'
     else:
-        return '.venv/bin/pip'
+        return '.venv/bin/python'
 
 
 def main():
@@ -67,6 +72,10 @@ def main():
     print("Setting up Twilio ConversationRelay project...")
     print(f"Platform: {platform.system()} {platform.release()}")
     
+    if sys.version_info < MIN_PYTHON:
+        print(f"ERROR: Python {'.'.join(map(str, MIN_PYTHON))}+ is required, found {platform.python_version()}")
+        return False
+    
     # Get project root directory
     project_root = Path(__file__).parent.absolute()
     print(f"Project root: {project_root}")
@@ -77,6 +86,9 @@ def main():
         return False
     
     python_exe = get_python_executable()
+    if not python_exe:
+        print("ERROR: Could not find a Python interpreter!")
+        return False
     print(f"Using Python: {python_exe}")
     
     try:
@@ -92,8 +104,15 @@ def main():
         user_input = input("Do you want to recreate it? (y/N): ").strip().lower()
         if user_input in ['y', 'yes']:
             print("Removing existing virtual environment...")
-            import shutil
-            shutil.rmtree(venv_path)
+            # Move it aside and delete it while the new one is set up; the
+            # non-daemon thread keeps the process alive until it finishes
+            stale_path = venv_path.with_name(f'.venv.old-{os.getpid()}')
+            try:
+                venv_path.rename(stale_path)
+            except OSError:
+                shutil.rmtree(venv_path)
+            else:
+                threading.Thread(target=shutil.rmtree, args=(stale_path,), kwargs={'ignore_errors': True}).start()
         else:
             print("Using existing virtual environment")
     
@@ -104,17 +123,18 @@ def main():
             return False
         print("Virtual environment created successfully")
     
-    # Install/upgrade pip
-    print("Upgrading pip...")
-    pip_exe = get_pip_executable()
-    pip_path = project_root / pip_exe
+    # Install requirements in one pip run, upgrading only pip when it is older
+    # than MIN_PIP; already satisfied requirements are left as they are. pip is
+    # run through the venv Python because pip.exe cannot replace itself on Windows
+    print("Installing requirements from requirements.txt...")
+    venv_python = project_root / get_venv_python()
     
-    if not run_command([str(pip_path), 'install', '--upgrade', 'pip'], cwd=project_root):
-        print("WARNING: Could not upgrade pip")
+    # Keep downloaded and built wheels in the project so reruns skip them
+    cache_dir = project_root / '.pip-cache'
     
-    # Install requirements
-    print("Installing requirements from requirements.txt...")
-    if not run_command([str(pip_path), 'install', '-r', 'requirements.txt'], cwd=project_root):
+    if not run_command([str(venv_python), '-m', 'pip', 'install', f'pip>={MIN_PIP}', '-r', 'requirements.txt',
+                        '--upgrade-strategy', 'only-if-needed', '--no-input', '--disable-pip-version-check',
+                        '--cache-dir', str(cache_dir), '--prefer-binary'], cwd=project_root):
         print("ERROR: Failed to install requirements!")
         return False
     
@@ -123,13 +143,14 @@ def main():
     print("\nSetup completed successfully!")
     print("\nTo activate the virtual environment:")
     
-    system = platform.system().lower()
-    if system == 'windows':
+    if SYSTEM == 'windows':
         print("   Windows (Command Prompt): .venv\\Scripts\\activate.bat")
         print("   Windows (PowerShell):     .venv\\Scripts\\Activate.ps1")
     else:
         print("   Unix/Linux/macOS:        source .venv/bin/activate")
     
+    print(f"\nPip cache (persist or mount it to speed up reruns): {cache_dir}")
+    
     print("\nTo run the application:")
     print("   python app.py")
     
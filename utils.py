@@ -1,13 +1,183 @@
 """Utility functions for logging configuration and conversation tracking."""
 import os
+import copy
+import time
+import queue
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import threading
+from collections import OrderedDict
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+import orjson
+
+LOG_BUFFER_SIZE = 64 * 1024  # Write buffer per log file
+LOG_FLUSH_INTERVAL = 0.5  # Seconds between background flushes of buffered log files
+SESSION_LOG_FILE_LIMIT = 128  # Per-session conversation files kept open at once
+
+# Create the log directories once; handlers report any failure when they open files
+try:
+    os.makedirs('logs/conversations', exist_ok=True)
+except OSError:
+    pass
+
+_buffered_handlers = []
+_flush_thread = None
+
+def _flush_buffered_handlers():
+    """Periodically flush every buffered log file so tails stay current."""
+    while True:
+        time.sleep(LOG_FLUSH_INTERVAL)
+        for handler in list(_buffered_handlers):
+            try:
+                handler.flush()
+            except OSError:
+                pass
+
+class BufferedRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler that batches writes instead of flushing every record.
+    
+    Records are collected in a 64KB write buffer that is flushed for ERROR
+    and above, on rollover and close, and by a background thread every
+    LOG_FLUSH_INTERVAL seconds. The rollover check uses a running count of
+    the bytes written rather than stat/seek calls per record.
+    """
+    
+    def __init__(self, *args, fsync=False, **kwargs):
+        """Create the handler and register it for background flushing.
+        
+        Args:
+            *args: Positional arguments for RotatingFileHandler
+            fsync (bool): Also fsync the file after ERROR records
+            **kwargs: Keyword arguments for RotatingFileHandler
+        """
+        global _flush_thread
+        self.fsync = fsync
+        super().__init__(*args, **kwargs)
+        _buffered_handlers.append(self)
+        if _flush_thread is None:
+            _flush_thread = threading.Thread(target=_flush_buffered_handlers, name='log-flusher', daemon=True)
+            _flush_thread.start()
+    
+    def _open(self):
+        stream = open(self.baseFilename, self.mode, buffering=LOG_BUFFER_SIZE,
+                      encoding=self.encoding, errors=self.errors)
+        # Track the size from here on instead of seeking the stream per record,
+        # which would also flush the write buffer
+        self.size = os.fstat(stream.fileno()).st_size
+        self.rotatable = os.path.isfile(self.baseFilename)  # bpo-45401: only roll over regular files
+        return stream
+    
+    def emit(self, record):
+        try:
+            msg = self.format(record) + self.terminator
+            msg_size = len(msg.encode(self.encoding or 'utf-8'))  # maxBytes is a byte limit
+            if self.stream is None:
+                self.stream = self._open()
+            # Rollover check done inline on the tracked size; shouldRollover would format again
+            if self.rotatable and 0 < self.maxBytes <= self.size + msg_size:
+                self.doRollover()
+            self.stream.write(msg)
+            self.size += msg_size
+            if record.levelno >= logging.ERROR:
+                self.flush()
+                if self.fsync:
+                    os.fsync(self.stream.fileno())
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+class JSONLineFormatter(logging.Formatter):
+    """Format session and conversation records as one JSON object per line.
+    
+    The timestamp is the record's epoch time in milliseconds, so no
+    strftime or %-template work is done per record. Speaker and exception
+    text are included only when the record has them.
+    """
+    
+    def format(self, record):
+        entry = {
+            'ts': int(record.created * 1000),
+            'level': record.levelname,
+            'session_id': getattr(record, 'session_id', None),
+            'call_sid': getattr(record, 'call_sid', None),
+            'message': record.getMessage(),
+        }
+        speaker = getattr(record, 'speaker', None)
+        if speaker is not None:
+            entry['speaker'] = speaker
+        exc_text = record.exc_text or (record.exc_info and self.formatException(record.exc_info))
+        if exc_text:
+            entry['exc'] = exc_text
+        return orjson.dumps(entry).decode()
+
+# Formatters are shared by every handler that uses the same layout
+APP_FORMATTER = logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+JSON_LINE_FORMATTER = JSONLineFormatter()
+SESSION_CONVERSATION_FORMATTER = logging.Formatter(  # Simplified format for per-session conversation files
+    '%(asctime)s - %(speaker)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+class ExceptionTextQueueHandler(QueueHandler):
+    """QueueHandler that keeps a record's traceback apart from its message.
+    
+    The stdlib prepare() folds the traceback into the message. Here it is
+    rendered into exc_text instead, so the listener's formatter places it:
+    the text formatters append it as before and the JSON formatter writes
+    it as its own field.
+    """
+    
+    def prepare(self, record):
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = APP_FORMATTER.formatException(record.exc_info)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None  # Tracebacks hold frames; only the text crosses threads
+        return record
+
+_queue_listeners = []
+
+def stop_queue_listeners():
+    """Stop the logging listener threads after writing and flushing queued records.
+    
+    Called on application shutdown and again at interpreter exit; stopping
+    is done once, so later calls do nothing.
+    """
+    while _queue_listeners:
+        listener = _queue_listeners.pop()
+        listener.stop()
+        for handler in listener.handlers:
+            handler.flush()
+
+atexit.register(stop_queue_listeners)
+
+def _start_queue_listener(*handlers):
+    """Start a background listener thread that writes records to the given handlers.
+    
+    Args:
+        *handlers: Handlers that format and write the records
+        
+    Returns:
+        QueueHandler: Handler to attach to a logger; it only enqueues records
+    """
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _queue_listeners.append(listener)
+    return ExceptionTextQueueHandler(log_queue)
 
 def setup_logging():
     """Configure logging with both file and console output.
     
     Sets up rotating file handlers for application logs and errors,
-    plus console output for real-time monitoring.
+    plus console output for real-time monitoring. The root logger only
+    enqueues records; a background listener thread formats and writes
+    them, so logging never blocks the event loop on I/O.
     
     Returns:
         logging.Logger: Configured logger instance
@@ -19,118 +189,103 @@ def setup_logging():
     if root_logger.handlers:
         return logging.getLogger(__name__)
     
-    # Create logs directory if it doesn't exist
-    os.makedirs('logs', exist_ok=True)
-    
-    # Create formatter
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    
     # Create file handler with rotation
-    file_handler = RotatingFileHandler(
+    file_handler = BufferedRotatingFileHandler(
         'logs/coffeemarket_app.log',
         maxBytes=10*1024*1024,  # 10MB
         backupCount=5,
         encoding='utf-8'
     )
-    file_handler.setFormatter(formatter)
+    file_handler.setFormatter(APP_FORMATTER)
     file_handler.setLevel(logging.DEBUG)
     
     # Create console handler
     console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
+    console_handler.setFormatter(APP_FORMATTER)
     console_handler.setLevel(logging.INFO)
     
-    # Configure root logger
-    root_logger.setLevel(logging.DEBUG)
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
-    
     # Create separate error log for critical issues
-    error_handler = RotatingFileHandler(
+    error_handler = BufferedRotatingFileHandler(
         'logs/coffeemarket_errors.log',
         maxBytes=5*1024*1024,  # 5MB
         backupCount=3,
-        encoding='utf-8'
+        encoding='utf-8',
+        fsync=True
     )
-    error_handler.setFormatter(formatter)
+    error_handler.setFormatter(APP_FORMATTER)
     error_handler.setLevel(logging.ERROR)
-    root_logger.addHandler(error_handler)
+    
+    # Configure root logger; records are written from a listener thread
+    root_logger.setLevel(logging.DEBUG)
+    root_logger.addHandler(_start_queue_listener(file_handler, console_handler, error_handler))
     
     return logging.getLogger(__name__)
 
+def _build_rotating_logger(logger_name, filename, max_bytes, backup_count, formatter,
+                           level=logging.INFO, propagate=False):
+    """Build a named logger that writes one rotating file from a listener thread.
+    
+    Args:
+        logger_name (str): Name passed to logging.getLogger
+        filename (str): Log file path
+        max_bytes (int): Size at which the file is rotated
+        backup_count (int): Number of rotated files to keep
+        formatter (logging.Formatter): Formatter for the file
+        level (int): Logger level
+        propagate (bool): Whether records also reach the root logger
+        
+    Returns:
+        logging.Logger: Configured logger instance
+    """
+    named_logger = logging.getLogger(logger_name)
+    
+    # Check if handlers are already configured to prevent duplicates
+    if named_logger.handlers:
+        return named_logger
+    
+    handler = BufferedRotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    handler.setFormatter(formatter)
+    named_logger.addHandler(_start_queue_listener(handler))
+    named_logger.setLevel(level)
+    named_logger.propagate = propagate
+    
+    return named_logger
+
 def setup_session_logging():
     """Setup separate logger for customer session tracking.
     
-    Creates dedicated logger for session events with custom formatting
-    that includes session_id and call_sid in log entries.
+    Creates dedicated logger for session events written as JSON lines
+    that include session_id and call_sid. Like the root logger, it only
+    enqueues records for a listener thread to write.
     
     Returns:
         logging.Logger: Session-specific logger instance
     """
-    session_logger = logging.getLogger('session')
-    
-    # Check if handlers are already configured to prevent duplicates
-    if session_logger.handlers:
-        return session_logger
-    
-    session_handler = RotatingFileHandler(
+    return _build_rotating_logger(
+        'session',
         'logs/customer_sessions.log',
-        maxBytes=20*1024*1024,  # 20MB
-        backupCount=10,
-        encoding='utf-8'
-    )
-    
-    # Custom format includes session and call identifiers
-    session_formatter = logging.Formatter(
-        '%(asctime)s - SESSION_ID:%(session_id)s - CALL_SID:%(call_sid)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
+        max_bytes=20*1024*1024,  # 20MB
+        backup_count=10,
+        formatter=JSON_LINE_FORMATTER
     )
-    session_handler.setFormatter(session_formatter)
-    session_logger.addHandler(session_handler)
-    session_logger.setLevel(logging.INFO)
-    session_logger.propagate = False  # Don't propagate to root logger
-    
-    return session_logger
 
 def setup_conversation_logging():
     """Setup separate logger for conversation history tracking.
     
-    Creates dedicated logger for conversation turns with speaker
-    identification and larger file rotation limits.
+    Creates dedicated logger for conversation turns, written as JSON
+    lines with speaker identification, and larger file rotation limits.
+    Records are written from a listener thread.
     
     Returns:
         logging.Logger: Conversation-specific logger instance
     """
-    conversation_logger = logging.getLogger('conversation')
-    
-    # Check if handlers are already configured to prevent duplicates
-    if conversation_logger.handlers:
-        return conversation_logger
-    
-    # Create logs directory if it doesn't exist
-    os.makedirs('logs', exist_ok=True)
-    
-    conversation_handler = RotatingFileHandler(
+    return _build_rotating_logger(
+        'conversation',
         'logs/conversation_history.log',
-        maxBytes=50*1024*1024,  # 50MB
-        backupCount=20,
-        encoding='utf-8'
-    )
-    
-    # Custom format includes speaker identification
-    conversation_formatter = logging.Formatter(
-        '%(asctime)s - SESSION:%(session_id)s - CALL:%(call_sid)s - %(speaker)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
+        max_bytes=50*1024*1024,  # 50MB
+        backup_count=20,
+        formatter=JSON_LINE_FORMATTER
     )
-    conversation_handler.setFormatter(conversation_formatter)
-    conversation_logger.addHandler(conversation_handler)
-    conversation_logger.setLevel(logging.INFO)
-    conversation_logger.propagate = False  # Don't propagate to root logger
-    
-    return conversation_logger
 
 def log_conversation_turn(session_id, call_sid, speaker, message, conversation_logger):
     """Log a single conversation turn.
@@ -142,6 +297,8 @@ def log_conversation_turn(session_id, call_sid, speaker, message, conversation_l
         message (str): Conversation message content
         conversation_logger: Logger instance for conversation tracking
     """
+    if not conversation_logger.isEnabledFor(logging.INFO):
+        return
     conversation_logger.info(
         message,
         extra={
@@ -151,37 +308,131 @@ def log_conversation_turn(session_id, call_sid, speaker, message, conversation_l
         }
     )
 
+class _NoLock:
+    """Stand-in for a handler lock when only one thread ever uses the handler."""
+    
+    def acquire(self, *args):
+        return True
+    
+    def release(self):
+        pass
+    
+    __enter__ = acquire
+    
+    def __exit__(self, *exc_info):
+        pass
+
+class SessionConversationHandler(logging.Handler):
+    """Write per-session conversation records to one file per session.
+    
+    Records carry session_id and call_sid, which select the file. Each
+    record is written with a single os.write on an O_APPEND descriptor,
+    bypassing Python's buffered text I/O. At most SESSION_LOG_FILE_LIMIT
+    files stay open; the least recently used one is closed when another is
+    opened and reopened for append if written again.
+    
+    Session loggers are only used from the event loop thread, so the
+    handler skips the per-record RLock that logging.Handler takes.
+    """
+    
+    def __init__(self, directory):
+        """Create the handler.
+        
+        Args:
+            directory (str): Directory holding the per-session files
+        """
+        super().__init__()
+        self.directory = directory
+        self.fds = OrderedDict()  # session_id -> open file descriptor, least recent first
+    
+    def createLock(self):
+        self.lock = _NoLock()
+    
+    def _get_fd(self, session_id, call_sid):
+        fd = self.fds.get(session_id)
+        if fd is not None:
+            self.fds.move_to_end(session_id)
+            return fd
+        path = os.path.join(self.directory, f'conversation_{session_id}_{call_sid}.log')
+        fd = self.fds[session_id] = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if len(self.fds) > SESSION_LOG_FILE_LIMIT:
+            os.close(self.fds.popitem(last=False)[1])
+        return fd
+    
+    def emit(self, record):
+        try:
+            fd = self._get_fd(record.session_id, record.call_sid)
+            os.write(fd, (self.format(record) + '\n').encode('utf-8'))
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+    
+    def close_session(self, session_id):
+        """Close the file of an ended session.
+        
+        Args:
+            session_id (str): Unique session identifier
+        """
+        self.acquire()
+        try:
+            fd = self.fds.pop(session_id, None)
+            if fd is not None:
+                os.close(fd)
+        finally:
+            self.release()
+    
+    def close(self):
+        self.acquire()
+        try:
+            for fd in self.fds.values():
+                os.close(fd)
+            self.fds.clear()
+        finally:
+            self.release()
+        super().close()
+
+class SessionConversationAdapter(logging.LoggerAdapter):
+    """Tag records with session identifiers while keeping per-call extra fields."""
+    
+    def process(self, msg, kwargs):
+        kwargs['extra'] = {**self.extra, **kwargs['extra']} if 'extra' in kwargs else self.extra
+        return msg, kwargs
+
+_session_conversation_handler = None
+
 def setup_session_conversation_logging(session_id, call_sid):
     """Setup individual conversation log file for a specific session.
     
     Creates a dedicated log file for each conversation session
-    for easy individual session review and debugging.
+    for easy individual session review and debugging. All sessions share
+    one logger and handler; the returned adapter routes records to this
+    session's file.
     
     Args:
         session_id (str): Unique session identifier
         call_sid (str): Twilio call SID
         
     Returns:
-        logging.Logger: Session-specific conversation logger
+        logging.LoggerAdapter: Session-specific conversation logger
     """
-    session_conv_logger = logging.getLogger(f'conversation_{session_id}')
+    global _session_conversation_handler
+    session_conv_logger = logging.getLogger('session_conversation')
     
-    # Create logs directory if it doesn't exist
-    os.makedirs('logs/conversations', exist_ok=True)
-    
-    session_conv_handler = logging.FileHandler(
-        f'logs/conversations/conversation_{session_id}_{call_sid}.log',
-        encoding='utf-8'
-    )
+    if _session_conversation_handler is None:
+        _session_conversation_handler = SessionConversationHandler('logs/conversations')
+        _session_conversation_handler.setFormatter(SESSION_CONVERSATION_FORMATTER)
+        session_conv_logger.addHandler(_session_conversation_handler)
+        session_conv_logger.setLevel(logging.INFO)
+        session_conv_logger.propagate = False
     
-    # Simplified format for per-session conversation files
-    session_conv_formatter = logging.Formatter(
-        '%(asctime)s - %(speaker)s: %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    session_conv_handler.setFormatter(session_conv_formatter)
-    session_conv_logger.addHandler(session_conv_handler)
-    session_conv_logger.setLevel(logging.INFO)
-    session_conv_logger.propagate = False
+    return SessionConversationAdapter(session_conv_logger, {'session_id': session_id, 'call_sid': call_sid})
+
+def close_session_conversation_logging(session_id):
+    """Close the conversation log file of an ended session.
     
-    return session_conv_logger
+    Args:
+        session_id (str): Unique session identifier
+    """
+    if _session_conversation_handler is not None:
+        _session_conversation_handler.close_session(session_id)